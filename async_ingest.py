@@ -0,0 +1,169 @@
+""" async_ingest.py - asyncio-driven camera ingestion for large camera counts
+
+One coroutine per camera instead of one OS thread per camera: blocking capture calls (open, read)
+are multiplexed over a bounded thread pool, reconnects wait with exponential backoff in the event loop.
+FrameStream lets consumers read FrameBus with 'async for'.
+"""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from config import cfg
+from camera import Camera
+from supervisor import BACKOFF, CONNECTING, ONLINE, STOPPED, Backoff
+
+
+class AsyncIngestor(threading.Thread):
+    """ runs asyncio loop with capture coroutines for all cams
+
+    publish(cam) is called in executor after successful cam.get_frame() (it makes frame and puts it in the bus);
+    cams can be added and removed while running (cluster rebalance)
+    """
+
+    def __init__(self, cams: List[Camera], publish: Callable[[Camera], bool], workers: int,
+                 backoff_min: float = 1.0, backoff_max: float = 30.0, backoff_jitter: float = 0.0):
+        super().__init__(name="_worker_ingest")
+        self._cams: List[Camera] = cams
+        self._publish: Callable[[Camera], bool] = publish
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="_ingest")
+        self._backoff_min: float = backoff_min
+        self._backoff_max: float = backoff_max
+        self._backoff_jitter: float = backoff_jitter
+        self._loop: asyncio.AbstractEventLoop = None
+        self._stop_event: asyncio.Event = None
+        self._stop_requested: bool = False
+        self._ready = threading.Event()  # loop is running, cams can be added/removed
+        self._tasks: Dict[int, asyncio.Task] = {}  # cam_id -> capture coroutine task
+        self._cam_stops: Dict[int, asyncio.Event] = {}  # cam_id -> set to stop cam capture
+
+    def run(self):
+        asyncio.run(self._main())
+        self._executor.shutdown(wait=True)
+        logging.debug("async ingestion stopped")
+
+    def stop(self):
+        """ stop all capture coroutines (thread-safe) """
+        self._stop_requested = True
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop_all)
+
+    def _stop_all(self):
+        self._stop_event.set()
+        for stop in self._cam_stops.values():
+            stop.set()
+
+    async def _main(self):
+        self._stop_event = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        for cam in self._cams:
+            self._start_cam(cam)
+        self._ready.set()
+        if self._stop_requested:
+            self._stop_all()
+        await self._stop_event.wait()
+        await asyncio.gather(*self._tasks.values())
+
+    def _start_cam(self, cam: Camera):
+        stop = self._cam_stops[cam.cam_id] = asyncio.Event()
+        if self._stop_event.is_set():
+            stop.set()
+        self._tasks[cam.cam_id] = self._loop.create_task(self._cam_loop(cam, stop))
+
+    async def _add_cam(self, cam: Camera):
+        if cam.cam_id not in self._tasks:
+            self._cams.append(cam)
+            self._start_cam(cam)
+
+    async def _remove_cam(self, cam: Camera):
+        task = self._tasks.get(cam.cam_id)
+        if task is None:
+            return
+        self._cam_stops[cam.cam_id].set()
+        try:
+            await asyncio.wait_for(asyncio.shield(task), cfg['supervisor_stop_timeout'])
+        except asyncio.TimeoutError:
+            logging.warning(f"Capture of {cam} didn't stop")
+        self._cams.remove(cam)
+        del self._tasks[cam.cam_id], self._cam_stops[cam.cam_id]
+
+    def add_cam(self, cam: Camera):
+        """ start capture of cam (thread-safe) """
+        self._ready.wait()
+        asyncio.run_coroutine_threadsafe(self._add_cam(cam), self._loop).result()
+
+    def remove_cam(self, cam: Camera):
+        """ stop capture of cam, wait for it up to supervisor_stop_timeout (thread-safe) """
+        self._ready.wait()
+        asyncio.run_coroutine_threadsafe(self._remove_cam(cam), self._loop).result()
+
+    async def _call(self, func, *args):
+        return await self._loop.run_in_executor(self._executor, func, *args)
+
+    @staticmethod
+    async def _sleep(delay: float, stop: asyncio.Event) -> bool:
+        """ sleep unless stopped, return True if stopped """
+        try:
+            await asyncio.wait_for(stop.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+        return stop.is_set()
+
+    def _read(self, cam: Camera) -> bool:
+        try:
+            if not cam.get_frame():
+                return False
+            self._publish(cam)
+        except Exception:
+            logging.exception(f"Capture error in {cam}")
+            return False
+        return True
+
+    async def _cam_loop(self, cam: Camera, stop: asyncio.Event):
+        """ connect, read while ok, reconnect with jittered exponential backoff """
+        backoff = Backoff(self._backoff_min, self._backoff_max, self._backoff_jitter)
+        while not stop.is_set():
+            logging.debug(f"{cam} is waiting for connect")
+            cam.health = CONNECTING
+            if await self._call(cam.open, cfg['camera_open_timeout']):
+                logging.info(f"{cam} connected")
+                cam.health = ONLINE
+                backoff.reset()
+                while not stop.is_set() and await self._call(self._read, cam):
+                    pass
+                if stop.is_set():
+                    break
+                logging.warning(f"Read error in {cam}")
+            else:
+                logging.warning(f"Can't connect {cam}")
+            await self._call(cam.close)
+            cam.reconnects += 1
+            cam.health = BACKOFF
+            if await self._sleep(backoff.next(), stop):
+                break
+        await self._call(cam.close)
+        cam.health = STOPPED
+
+
+class FrameStream:
+    """ async iterator over FrameBus frames: 'async for frame in FrameStream(bus)' (frame.release() when done) """
+
+    def __init__(self, frame_bus, timeout: float = 1.0):
+        self._bus = frame_bus
+        self._timeout: float = timeout
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="_frame_stream")
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            frame = await loop.run_in_executor(self._executor, self._bus.get, self._timeout)
+            if frame is not None:
+                return frame
+            if self._bus.closed:
+                self._executor.shutdown(wait=False)
+                raise StopAsyncIteration
@@ -0,0 +1,153 @@
+""" bench.py - throughput benchmark of vsrv pipeline (capture -> frame processing -> FrameWriter)
+
+N simulated cams (see sources.py) run through vsrv as in production; after warmup, metrics are collected for
+given number of seconds: fps, per-stage latency percentiles, CPU and peak RSS (main process + workers, via /proc).
+In 'process' mode worker stages (process, write, latency) come from workers every processing_metrics_interval,
+so their window is shifted by up to that interval.
+
+    python bench.py --cams 16 --source synthetic:1280x720 --source-fps 25 --seconds 20
+    python bench.py --source file:/path/to/video.mp4 --cams 4
+    python bench.py --suite --json baseline.json   # standard scenarios, each in own process
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+from config import cfg
+from camera import Camera
+from metrics import Metrics
+
+STAGES = ('capture', 'decode', 'queue', 'process', 'write', 'latency')
+SUITE: List[List[str]] = [  # standard scenarios: baseline for performance changes
+    ['--cams', '4', '--source-fps', '0'],
+    ['--cams', '16', '--source-fps', '25'],
+    ['--cams', '16', '--source-fps', '25', '--no-write'],
+    ['--cams', '16', '--source-fps', '25', '--processing', 'process'],
+    ['--cams', '32', '--source-fps', '10', '--ingest', 'async'],
+]
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='vsrv pipeline benchmark with simulated cams')
+    parser.add_argument('--cams', type=int, default=8, help='number of simulated cams')
+    parser.add_argument('--source', default='synthetic:1280x720', help='synthetic:WxH or file:<path>')
+    parser.add_argument('--source-fps', type=float, default=25.0, help='frames per sec of each cam, 0 - max speed')
+    parser.add_argument('--seconds', type=float, default=10.0, help='measured time')
+    parser.add_argument('--warmup', type=float, default=2.0, help='time before measuring')
+    parser.add_argument('--no-write', action='store_true', help='do not encode frames to video files')
+    parser.add_argument('--processing', choices=('thread', 'process'), default=cfg['processing_mode'])
+    parser.add_argument('--ingest', choices=('threads', 'async'), default=cfg['ingest_mode'])
+    parser.add_argument('--json', help='append results to this json file')
+    parser.add_argument('--suite', action='store_true', help='run standard scenarios')
+    return parser.parse_args(argv)
+
+
+def _proc_usage(pid: int) -> Tuple[float, float]:
+    """ (cpu sec, peak rss MB) of live process pid from /proc, (0, 0) if it has exited """
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()  # fields after (comm), comm may contain spaces
+        with open(f'/proc/{pid}/status') as f:
+            peak_kb = next((int(line.split()[1]) for line in f if line.startswith('VmHWM:')), 0)
+    except OSError:
+        return 0.0, 0.0
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK'), peak_kb / 1024  # utime + stime
+
+
+def _usage() -> Dict[int, Tuple[float, float]]:
+    """ pid -> (cpu sec, peak rss MB) of this process and its live children (frame processing workers) """
+    pids = [os.getpid()] + [p.pid for p in multiprocessing.active_children()]
+    return {pid: _proc_usage(pid) for pid in pids}
+
+
+def run(args: argparse.Namespace) -> Dict:
+    """ run one scenario in this process """
+    folder = tempfile.mkdtemp(prefix='vint_bench_')
+    cfg.update(write_frames=not args.no_write, write_frames_folder=folder + '/', processing_mode=args.processing,
+               ingest_mode=args.ingest, show_frames=False, detect_persons=False, dashboard=False,
+               metrics_log_interval=0, metrics_port=None)
+    import vsrv  # after cfg is set: module state depends on it
+    for i in range(args.cams):
+        Camera.cam_list.append(Camera(f'bench{i}', args.source, {'source_fps': str(args.source_fps), 'loop': 'yes'}))
+    fp = vsrv.start_vserv()
+    time.sleep(args.warmup)
+    Metrics.reset()
+    usage_start, wall_start = _usage(), time.time()
+    time.sleep(args.seconds)
+    elapsed = time.time() - wall_start
+    usage_end = _usage()  # workers are sampled while alive: RUSAGE_CHILDREN counts them only after exit
+    result = {'cams': args.cams, 'source': args.source, 'source_fps': args.source_fps, 'write': not args.no_write,
+              'processing': args.processing, 'ingest': args.ingest, 'seconds': round(elapsed, 2),
+              'capture_fps': round(sum(Metrics.counter('frames', c.cam_name) for c in Camera.cam_list) / elapsed, 1),
+              'processed_fps': round(Metrics.stage_histogram('process').total / elapsed, 1),
+              'written_fps': round(Metrics.stage_histogram('write').total / elapsed, 1),
+              'dropped': sum(Metrics.counter('dropped', c.cam_name) for c in Camera.cam_list),
+              'write_dropped': sum(Metrics.counter('write_dropped', c.cam_name) for c in Camera.cam_list)}
+    result['stages'] = {}  # stage -> latency mean and percentiles
+    for stage in STAGES:
+        h = Metrics.stage_histogram(stage)
+        if h.total:
+            result['stages'][stage] = {'mean_ms': round(1000 * h.sum / h.total, 2),
+                             **{f'p{q}_ms': round(1000 * h.percentile(q / 100), 2) for q in (50, 95, 99)}}
+    vsrv.stop_vserv()
+    fp.join()
+    cpu = sum(end_cpu - usage_start.get(pid, (0.0, 0.0))[0] for pid, (end_cpu, _) in usage_end.items())
+    result['cpu_percent'] = round(100 * cpu / elapsed, 1)  # all processes, may be > 100 (several cores)
+    result['peak_rss_mb'] = round(sum(peak_rss for _, peak_rss in usage_end.values()), 1)  # sum of processes
+    shutil.rmtree(folder, ignore_errors=True)
+    return result
+
+
+def run_suite(args: argparse.Namespace) -> List[Dict]:
+    """ each scenario in own process (vsrv module state is per process) """
+    results = []
+    for scenario in SUITE:
+        fd, out = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        os.unlink(out)
+        cmd = [sys.executable, os.path.abspath(__file__), *scenario, '--source', args.source,
+               '--seconds', str(args.seconds), '--warmup', str(args.warmup), '--json', out]
+        print(f"Scenario: {' '.join(scenario)}", flush=True)
+        subprocess.run(cmd, check=True)
+        with open(out) as f:
+            results += json.load(f)
+        os.unlink(out)
+    return results
+
+
+def report(results: List[Dict]):
+    print(f"{'cams':>4s} {'src.fps':>7s} {'write':5s} {'proc':7s} {'ingest':7s} {'capt.fps':>8s} {'proc.fps':>8s} "
+          f"{'wr.fps':>7s} {'drops':>6s} {'lat.p50':>8s} {'lat.p99':>8s} {'cpu%':>6s} {'rss.MB':>7s}")
+    for r in results:
+        latency = r['stages'].get('latency', {})
+        print(f"{r['cams']:4d} {r['source_fps']:7.1f} {str(r['write']):5s} {r['processing']:7s} {r['ingest']:7s} "
+              f"{r['capture_fps']:8.1f} {r['processed_fps']:8.1f} {r['written_fps']:7.1f} {r['dropped']:6d} "
+              f"{latency.get('p50_ms', 0):8.1f} {latency.get('p99_ms', 0):8.1f} {r['cpu_percent']:6.1f} "
+              f"{r['peak_rss_mb']:7.1f}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, style='{', format='{threadName:22s}:{message}')
+    results = run_suite(args) if args.suite else [run(args)]
+    if args.json:
+        previous = []
+        if os.path.exists(args.json):
+            with open(args.json) as f:
+                previous = json.load(f)
+        with open(args.json, 'w') as f:
+            json.dump(previous + results, f, indent=1)
+    report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,14 @@
 """ Box, PersBox classes """
 
 import logging
-from typing import Tuple, List
+from typing import Iterable, List, Tuple, Union
 
 import numpy as np
 
+# one PersBox in PersBoxLst array
+PERS_BOX_DTYPE = np.dtype([('x_ul', 'i4'), ('y_ul', 'i4'), ('x_br', 'i4'), ('y_br', 'i4'),
+                           ('confidence', 'f8'), ('roi', 'i4')])
+
 
 class Box:
     """ rectangle box """
@@ -26,13 +30,40 @@ class Box:
 
 
 class PersBox(Box):
-    """ Person box - one person box detected in image """
+    """ Person box - one person box detected in image
+
+    fields are stored in PERS_BOX_DTYPE record: own one, or a view into PersBoxLst array (see PersBoxLst)
+    """
+    _FIELDS = ('x_ul', 'y_ul', 'x_br', 'y_br', 'confidence', 'roi')
 
     def __init__(self, box: Box, confidence: float, roi: int):
+        self._rec = np.zeros(1, PERS_BOX_DTYPE)[0]
         super().__init__((box.x_ul, box.y_ul), (box.x_br, box.y_br))
-        self.confidence: float = confidence
-        self.roi: int = roi
-        pass
+        self.confidence = confidence
+        self.roi = roi
+
+    @classmethod
+    def view(cls, arr: np.ndarray, index: int) -> "PersBox":
+        """ PersBox over arr[index]: changes of its fields go to arr """
+        pb = cls.__new__(cls)
+        pb._rec = arr[index]
+        return pb
+
+    def _field(name: str, cast):
+        return property(lambda self: cast(self._rec[name]),
+                        lambda self, value: self._rec.__setitem__(name, value))
+
+    x_ul = _field('x_ul', int)
+    y_ul = _field('y_ul', int)
+    x_br = _field('x_br', int)
+    y_br = _field('y_br', int)
+    confidence = _field('confidence', float)
+    roi = _field('roi', int)
+    del _field
+
+    @property
+    def record(self) -> tuple:
+        return tuple(getattr(self, name) for name in self._FIELDS)
 
     def __str__(self):
         return f"PBox({self.x_ul},{self.y_ul},{self.x_br},{self.y_br};{self.roi};{self.confidence})"
@@ -45,19 +76,127 @@ class PersBox(Box):
 
 
 class PersBoxLst:
-    """ List[PersBox] """
-
-    def __init__(self):
-        self.lst: List[PersBox] = []
+    """ List[PersBox] stored as structured numpy array (PERS_BOX_DTYPE), with vectorized geometry
+
+    items are PersBox views into the array (their changes go to the list), valid till next append()
+    """
+
+    def __init__(self, arr: np.ndarray = None):
+        self._buf: np.ndarray = arr if arr is not None else np.empty(0, PERS_BOX_DTYPE)  # capacity >= len
+        self._len: int = len(self._buf)
+
+    @property
+    def arr(self) -> np.ndarray:
+        return self._buf[:self._len]
+
+    @classmethod
+    def from_arrays(cls, coords: np.ndarray, confidence: np.ndarray, roi: Union[int, np.ndarray] = 0) -> "PersBoxLst":
+        """ coords: (N,4) array of x_ul,y_ul,x_br,y_br """
+        coords = np.asarray(coords).reshape(-1, 4)
+        arr = np.empty(len(coords), PERS_BOX_DTYPE)
+        for i, name in enumerate(('x_ul', 'y_ul', 'x_br', 'y_br')):
+            arr[name] = coords[:, i]
+        arr['confidence'] = confidence
+        arr['roi'] = roi
+        return cls(arr)
+
+    @classmethod
+    def from_boxes(cls, boxes: Iterable[PersBox]) -> "PersBoxLst":
+        return cls(np.array([pb.record for pb in boxes], PERS_BOX_DTYPE))
 
     def __str__(self):
-        return f"PBox[{[pb for pb in self.lst]}]"
+        return f"PBox[{[pb for pb in self]}]"
 
     def __repr__(self):
         return self.__str__()
 
-    def append(self, item):
-        self.lst.append(item)
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        arr = self.arr
+        return (PersBox.view(arr, i) for i in range(len(arr)))
+
+    def __getitem__(self, item) -> Union[PersBox, "PersBoxLst"]:
+        """ int --> PersBox view; slice, index array or bool mask --> PersBoxLst """
+        if isinstance(item, (int, np.integer)):
+            return PersBox.view(self.arr, item)
+        return PersBoxLst(self.arr[item])
+
+    def append(self, item: PersBox):
+        """ add copy of item (amortized O(1): array capacity is doubled when full) """
+        if self._len == len(self._buf):
+            buf = np.empty(max(8, 2 * self._len), PERS_BOX_DTYPE)
+            buf[:self._len] = self.arr
+            self._buf = buf
+        self._buf[self._len] = item.record
+        self._len += 1
+
+    def coords(self) -> np.ndarray:
+        """ (N,4) float array of x_ul,y_ul,x_br,y_br """
+        return np.stack([self.arr[name] for name in ('x_ul', 'y_ul', 'x_br', 'y_br')], axis=1).astype(np.float32)
+
+    def areas(self) -> np.ndarray:
+        return (np.maximum(0, self.arr['x_br'] - self.arr['x_ul']) *
+                np.maximum(0, self.arr['y_br'] - self.arr['y_ul'])).astype(np.float32)
+
+    def iou_matrix(self, other: "PersBoxLst") -> np.ndarray:
+        """ (len(self),len(other)) matrix of intersection over union """
+        a, b = self.coords()[:, None, :], other.coords()[None, :, :]
+        w = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+        h = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+        inter = w * h
+        union = self.areas()[:, None] + other.areas()[None, :] - inter
+        return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+    def nms(self, iou_threshold: float) -> "PersBoxLst":
+        """ non-maximum suppression: keep boxes not overlapping (iou > threshold) more confident ones """
+        order = np.argsort(-self.arr['confidence'], kind='stable')
+        boxes = self[order]
+        iou = boxes.iou_matrix(boxes)
+        keep = np.ones(len(boxes), bool)
+        for i in range(len(boxes)):  # loop over kept boxes only, suppression itself is vectorized
+            if keep[i]:
+                keep[i + 1:] &= iou[i, i + 1:] <= iou_threshold
+        return boxes[keep]
+
+    def filter_confidence(self, min_confidence: float) -> "PersBoxLst":
+        return self[self.arr['confidence'] >= min_confidence]
+
+    def filter_area(self, min_area: float = 0, max_area: float = None) -> "PersBoxLst":
+        areas = self.areas()
+        mask = areas >= min_area
+        if max_area is not None:
+            mask &= areas <= max_area
+        return self[mask]
+
+    def filter_roi(self, roi: int) -> "PersBoxLst":
+        return self[self.arr['roi'] == roi]
+
+    def assign_roi(self, polygons: List[List[Tuple[int, int]]]):
+        """ set roi of each box = 1-based index of first polygon containing box bottom-center point, 0 - none """
+        feet = np.stack([(self.arr['x_ul'] + self.arr['x_br']) / 2, self.arr['y_br']], axis=1)
+        roi = np.zeros(len(self), np.int32)
+        for i, polygon in reversed(list(enumerate(polygons))):
+            roi[_points_in_polygon(feet, np.asarray(polygon, np.float64))] = i + 1
+        self.arr['roi'] = roi
+
+    def clip(self, width: int, height: int) -> "PersBoxLst":
+        """ clip boxes to image (in place) """
+        np.clip(self.arr['x_ul'], 0, width - 1, out=self.arr['x_ul'])
+        np.clip(self.arr['x_br'], 0, width - 1, out=self.arr['x_br'])
+        np.clip(self.arr['y_ul'], 0, height - 1, out=self.arr['y_ul'])
+        np.clip(self.arr['y_br'], 0, height - 1, out=self.arr['y_br'])
+        return self
+
+
+def _points_in_polygon(points: np.ndarray, polygon: np.ndarray) -> np.ndarray:
+    """ even-odd rule for (N,2) points against (M,2) polygon, vectorized over points """
+    x, y = points[:, 0:1], points[:, 1:2]
+    x1, y1 = polygon[:, 0], polygon[:, 1]
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+    crosses = ((y1 > y) != (y2 > y)) & (x < (x2 - x1) * (y - y1) / np.where(y2 != y1, y2 - y1, 1e-9) + x1)
+    return np.count_nonzero(crosses, axis=1) % 2 == 1
 
 
 if __name__ == "__main__":
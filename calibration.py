@@ -0,0 +1,139 @@
+""" calibration.py - read-through cache of per-cam calibration (homography, calibrated w/h, ROI polygons)
+
+Calibrations are loaded from MyDb (transforms and polygons tables, by cam 'calibration' name) once,
+preloaded at Camera.init_cameras, so per-frame transforms and ROI tests never touch the db.
+Entry is reloaded in background (one loader per name) when its TTL expires or after invalidate();
+the stale entry is served meanwhile. Only a name never loaded before is loaded by the caller.
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from config import cfg
+
+
+class Calibration:
+    """ calibration of one cam """
+    def __init__(self, name: str, trans_mat: np.ndarray, width: int, height: int,
+                 polygons: List[List[Tuple[int, int]]]):
+        self.name: str = name
+        self.trans_mat: np.ndarray = trans_mat  # homography: cam image --> bird's-eye view
+        self.width: int = width  # calibrated (bird's-eye) image size
+        self.height: int = height
+        self.polygons: List[List[Tuple[int, int]]] = polygons  # ROI polygons in cam image coordinates
+
+    def __str__(self):
+        return f"Calibration({self.name},{self.width}x{self.height},polygons={len(self.polygons)})"
+
+
+class CalibrationCache:
+    _entries: Dict[str, Tuple[Calibration, float, int]] = {}  # name -> (calibration, load time, version)
+    _versions: Dict[str, int] = {}  # name -> version, bumped by invalidate()
+    _loading: Dict[str, threading.Event] = {}  # name -> set when its running load is finished
+    _lock = threading.Lock()
+    _db = None  # object with load_matrix(name) and load_points_from_db(name) (sandbox/my_db.py MyDb)
+    hits: int = 0
+    stale_hits: int = 0  # stale entry served while it's reloaded
+    misses: int = 0
+    load_errors: int = 0
+
+    @classmethod
+    def set_source(cls, db):
+        cls._db = db
+        cls.invalidate()
+
+    @classmethod
+    def _open_source(cls):
+        if cls._db is None and cfg['calibration_db']:
+            from sandbox.my_db import MyDb
+            params = dict(cfg['calibration_db'])
+            cls._db = MyDb(params, backend=params.pop('backend', 'mysql'))
+        return cls._db
+
+    @classmethod
+    def get(cls, name: str) -> Calibration:
+        """ calibration by name (from cache, possibly stale while reloaded), None if there is no calibration """
+        with cls._lock:
+            entry = cls._entries.get(name)
+            if entry is not None:
+                if time.monotonic() - entry[1] < cfg['calibration_ttl'] and entry[2] == cls._versions.get(name, 0):
+                    cls.hits += 1
+                else:
+                    cls.stale_hits += 1
+                    if name not in cls._loading:
+                        cls._loading[name] = threading.Event()
+                        threading.Thread(target=cls._refresh, args=(name,), name='CalibrationLoader',
+                                         daemon=True).start()
+                return entry[0]
+            cls.misses += 1
+            loading = cls._loading.get(name)
+            if loading is None:
+                cls._loading[name] = threading.Event()
+        if loading is None:
+            cls._refresh(name)
+        else:
+            loading.wait()  # the same name is being loaded by another caller
+        with cls._lock:
+            entry = cls._entries.get(name)
+        return entry[0] if entry is not None else None
+
+    @classmethod
+    def _refresh(cls, name: str):
+        """ (re)load entry of name, keep stale entry (till next TTL) if db fails; caller has set _loading[name] """
+        try:
+            with cls._lock:
+                version = cls._versions.get(name, 0)
+                old = cls._entries.get(name)
+            now = time.monotonic()
+            try:
+                calibration = cls._load(name)
+            except Exception:
+                cls.load_errors += 1
+                if old is None:
+                    raise
+                logging.exception(f"Calibration {name} reload failed, stale one is used")
+                calibration = old[0]
+            with cls._lock:
+                cls._entries[name] = (calibration, now, version)
+        finally:
+            with cls._lock:
+                cls._loading.pop(name).set()
+
+    @classmethod
+    def _load(cls, name: str) -> Calibration:
+        db = cls._open_source()
+        if db is None:
+            return None
+        try:
+            trans_mat, width, height = db.load_matrix(name)
+        except IndexError:  # no transform for this name
+            logging.warning(f"No calibration {name}")
+            return None
+        try:
+            polygons = [db.load_points_from_db(name)]
+        except IndexError:
+            polygons = []
+        return Calibration(name, trans_mat, width, height, polygons)
+
+    @classmethod
+    def invalidate(cls, name: str = None):
+        """ force reload of name (all names if None) on next get() """
+        with cls._lock:
+            for key in ([name] if name is not None else list(cls._entries.keys())):
+                cls._versions[key] = cls._versions.get(key, 0) + 1
+
+    @classmethod
+    def preload(cls, names: List[str]):
+        for name in names:
+            logging.debug(f"{cls.get(name)} preloaded")
+
+    @classmethod
+    def stats(cls) -> Dict:
+        total = cls.hits + cls.stale_hits + cls.misses
+        return {'hits': cls.hits, 'stale_hits': cls.stale_hits, 'misses': cls.misses,
+                'hit_rate': round((cls.hits + cls.stale_hits) / total, 3) if total else 0.0,
+                'load_errors': cls.load_errors, 'entries': len(cls._entries)}
@@ -1,26 +1,60 @@
 """ camera.py - actions with video cameras"""
 
 import csv
-from typing import List
+import threading
+import time
+from typing import Dict, List, Tuple
 
 import cv2
 import numpy as np
 
 from config import cfg
+from frame_pool import frame_pool
+from metrics import Metrics
+from sources import open_capture
+from frame_bus import OVERFLOW_POLICIES
+from calibration import Calibration, CalibrationCache
 
 
 class Camera:
     cam_list: List["Camera"] = []
     cam_list_size: int = 0
 
-    def __init__(self, cam_name: str, access_str: str):
+    def __init__(self, cam_name: str, access_str: str, options: Dict[str, str] = None):
         self.cam_id: int = Camera.cam_list_size
         Camera.cam_list_size += 1
         self.cam_name: str = cam_name
         self._access_str: str = access_str
+        options = options or {}
+        self.overflow_policy: str = options.get('overflow') or cfg['camera_overflow_policy']
+        if self.overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"{cam_name}: overflow policy {self.overflow_policy!r} is not one of {OVERFLOW_POLICIES}")
+        self.priority: int = int(options.get('priority') or cfg['camera_priority'])  # weight in frames draining
+        self.target_fps: float = float(options.get('fps') or cfg['camera_target_fps'])  # 0 - deliver all frames
+        self.record_mode: str = options.get('record') or cfg['camera_record_mode']  # encode | passthrough | none
+        self.decode: bool = (options.get('decode') or 'yes').lower() in ('yes', 'y', '+', '1')  # capture frames
+        self.motion_sensitivity: float = float(options.get('motion') or cfg['motion_sensitivity'])
+        self.roi: List[Tuple[int, int]] = self.parse_points(options.get('roi', ''))  # polygon, image coordinates
+        self.calibration_name: str = options.get('calibration', '')  # name in transforms/polygons db tables
+        self.source_fps: float = float(options.get('source_fps') or 0.0)  # offline sources rate, 0 - max speed
+        self.loop: bool = (options.get('loop') or 'yes').lower() in ('yes', 'y', '+', '1')  # replay file source
+        self.backend: str = options.get('backend') or cfg['camera_backend']  # any | ffmpeg | gstreamer
+        self.decode_threads: int = int(options.get('threads') or cfg['camera_decode_threads'])  # 0 - auto
+        # rtsp of passthrough recording: tcp | udp | '' - tcp (decoded capture uses site-wide camera_transport)
+        self.transport: str = options.get('transport') or cfg['camera_transport']
+        self.buffer_size: int = int(options.get('buffer_size') or cfg['camera_buffer_size'])  # frames, 0 - default
+        self.latency_mode: str = options.get('latency') or cfg['camera_latency_mode']  # all | newest
+        self.drained: int = 0  # buffered frames skipped in 'newest' latency mode
+        self._next_due: float = 0.0  # time when next frame has to be delivered (if target_fps is set)
+        self.skipped: int = 0  # frames grabbed but not decoded because of target_fps
         self.read_ok: bool = False
-        self.image: np.ndarray = None
+        self.frame_time: float = 0.0  # epoch time when last image was grabbed
+        self.reconnects: int = 0
+        self.image: np.ndarray = None  # buffer from frame_pool, owned by the frame it is passed to
+        self._image_shape: tuple = None  # shape of last read image (to take buffer from pool)
         self._handle: cv2.VideoCapture = None
+        self._handle_lock = threading.Lock()  # handle may be replaced by new worker while old one is stuck in read
+        self.health: str = 'stopped'  # connecting | online | backoff | stalled | stopped (set by capture workers)
 
     def __str__(self):
         return f"Cam({self.cam_id},{self.cam_name})"
@@ -28,29 +62,148 @@ class Camera:
     def __repr__(self):
         return self.__str__()
 
-    def open(self) -> bool:
-        self._handle = cv2.VideoCapture(self._access_str)
+    @staticmethod
+    def parse_points(points_str: str) -> List[Tuple[int, int]]:
+        """ 'x1 y1;x2 y2;...' --> [(x1,y1),(x2,y2),...] """
+        return [tuple(int(v) for v in p.split()) for p in points_str.split(';') if p.strip()]
+
+    @property
+    def access_str(self) -> str:
+        return self._access_str
+
+    @property
+    def calibration(self) -> Calibration:
+        """ cam calibration from CalibrationCache (None if cam is not calibrated) """
+        return CalibrationCache.get(self.calibration_name) if self.calibration_name else None
+
+    def open(self, timeout: float = None) -> bool:
+        """ open capture, give up if it takes longer than timeout sec (late handle is released when opened)
+
+        previous handle is detached, not released: it's released by close() before open or by stale read using it
+        """
+        with self._handle_lock:
+            self._handle = None
+        if timeout is None:
+            handle = self._open_capture()
+            with self._handle_lock:
+                self._handle = handle
+            return handle.isOpened()
+        result: List = []
+        abandoned = threading.Event()
+        done = threading.Event()
+
+        def opener():
+            handle = self._open_capture()
+            with self._handle_lock:
+                if abandoned.is_set():
+                    handle.release()
+                else:
+                    result.append(handle)
+            done.set()
+
+        threading.Thread(target=opener, name='_open_' + self.cam_name, daemon=True).start()
+        done.wait(timeout)
+        with self._handle_lock:
+            if not result:
+                abandoned.set()
+                return False
+            self._handle = result[0]
         return self._handle.isOpened()
 
+    def _open_capture(self):
+        return open_capture(self._access_str, self.source_fps, self.loop, self.backend, self.buffer_size,
+                            cfg['camera_open_timeout'], cfg['camera_read_timeout'], self.decode_threads)
+
     def get_frame(self) -> bool:
-        """ read next frame from cam, return True if OK"""
-        ret, self.image = self._handle.read()
-        self.read_ok = False if ret is False or self._handle.isOpened is False else True
+        """ read next frame from cam (decode into buffer from frame_pool), return True if OK
+
+        if target_fps is set, frames coming before due time are only grabbed (not decoded) and skipped.
+        If handle is replaced while reading (cam reopened by new worker), result is dropped and old handle released.
+        """
+        handle = self._handle
+        start = time.perf_counter()
+        frame_time = self._grab_due(handle)
+        if frame_time is None:
+            image = None
+        else:
+            buf = frame_pool.acquire(self._image_shape) if self._image_shape else None
+            decode_start = time.perf_counter()
+            ret, image = handle.retrieve(image=buf)
+            end = time.perf_counter()
+            if image is not buf:  # first read or shape changed: opencv allocated new image
+                frame_pool.release(buf)
+            if ret is False or handle.isOpened() is False:
+                frame_pool.release(image)
+                image = None
+        with self._handle_lock:
+            if handle is not self._handle:  # this read is stale
+                frame_pool.release(image)
+                handle.release()
+                return False
+            self.image = image
+            self.read_ok = image is not None
+            if self.read_ok:
+                self.frame_time = frame_time
+                self._image_shape = image.shape
+        if self.read_ok:
+            Metrics.observe('capture', self.cam_name, end - start)
+            Metrics.observe('decode', self.cam_name, end - decode_start)
         return self.read_ok
 
+    def _grab_due(self, handle) -> float:
+        """ grab frames till the one that has to be delivered, return its time (None if grab failed) """
+        while True:
+            grab_start = time.perf_counter()
+            if not handle.grab():
+                return None
+            buffered = time.perf_counter() - grab_start <= cfg['camera_drain_grab_time']  # frame didn't wait
+            if buffered and self.latency_mode == 'newest' and not self._drain(handle):
+                return None
+            frame_time = time.time()
+            if not self.target_fps or frame_time >= self._next_due:
+                break
+            self.skipped += 1
+        if self.target_fps:
+            self._next_due += 1.0 / self.target_fps
+            if self._next_due < frame_time:  # behind schedule: don't try to catch up
+                self._next_due = frame_time + 1.0 / self.target_fps
+        return frame_time
+
+    def _drain(self, handle) -> bool:
+        """ grab frames already buffered by backend (grab returns at once), so the newest one is delivered """
+        drained = 0
+        for _ in range(cfg['camera_drain_max']):
+            start = time.perf_counter()
+            if not handle.grab():
+                return False
+            drained += 1  # previous grabbed frame is skipped
+            if time.perf_counter() - start > cfg['camera_drain_grab_time']:  # waited for new frame: it's the newest
+                break
+        self.drained += drained
+        Metrics.count('drained', self.cam_name, drained)
+        return True
+
     def close(self):
-        self._handle.release()
-        self._handle = None
+        with self._handle_lock:
+            handle, self._handle = self._handle, None
+        if handle is not None:
+            handle.release()
 
     @classmethod
     def init_cameras(cls):
-        """ init list of cameras based on file-stored camera info """
+        """ init list of cameras based on file-stored camera info
+
+        columns: use flag ('+'), cam name, access string, then optional per-cam options (by header name)
+        """
         with open(cfg['camera_info_file'], newline='') as csvfile:
             reader = csv.reader(csvfile)
-            _ = reader.__next__()  # skip headers
+            headers = [h.strip().lower() for h in reader.__next__()]
             for row in reader:
                 if row[0].strip() == '+':
-                    cls.cam_list.append(Camera(cam_name=row[1], access_str=row[2]))
+                    options = {h: v.strip() for h, v in zip(headers[3:], row[3:]) if v.strip()}
+                    cls.cam_list.append(Camera(cam_name=row[1], access_str=row[2], options=options))
+        if cfg['calibration_db']:
+            CalibrationCache.preload([cam.calibration_name for cam in cls.cam_list if cam.calibration_name])
 
     @classmethod
     def print_cameras(cls):
@@ -0,0 +1,319 @@
+""" cluster.py - several vsrv nodes share cams of one cameras_info.csv
+
+Cams are split between alive nodes by consistent hashing of cam name (HashRing), so when a node joins
+or dies only its share of cams moves. Nodes send UDP heartbeats to each other (ClusterNode); node not heard
+for cluster_dead_after sec is dead and its cams are taken over by the others.
+Nodes forward selected frames and events to aggregator over TCP (FrameRelay -> FrameAggregator).
+
+Relay message: HEADER + payload
+    magic 'VINT', message type (frame|event), codec (raw|jpeg|json), node index, cam_id, frame time,
+    height, width, channels, numpy dtype str (e.g. '|u1'), payload length
+"""
+
+import bisect
+import hashlib
+import json
+import logging
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from typing import Callable, Dict, List, Set, Tuple
+
+import cv2
+import numpy as np
+
+from config import cfg
+
+HEADER = struct.Struct('<4sBBBHdHHB4sI')
+MAGIC = b'VINT'
+MSG_FRAME, MSG_EVENT = 1, 2
+CODEC_RAW, CODEC_JPEG, CODEC_JSON = 0, 1, 2
+CODECS = {'raw': CODEC_RAW, 'jpeg': CODEC_JPEG}
+
+
+class HashRing:
+    """ consistent hashing of keys to nodes (replicas virtual points per node) """
+
+    def __init__(self, nodes: List[str], replicas: int = 64):
+        points = sorted((self._hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas))
+        self._hashes: List[int] = [h for h, _ in points]
+        self._nodes: List[str] = [node for _, node in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+    def node_for(self, key: str) -> str:
+        if not self._hashes:
+            return None
+        i = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._nodes[i]
+
+
+def node_index(node_id: str, nodes: Dict[str, Tuple[str, int]]) -> int:
+    """ position of node in cluster_nodes: node number in relay messages, metrics port offset """
+    if node_id not in nodes:
+        raise ValueError(f"Cluster node {node_id!r} is not in cluster_nodes {sorted(nodes)}")
+    return list(nodes).index(node_id)
+
+
+class ClusterNode(threading.Thread):
+    """ heartbeats with peers, calls on_assign(cam names to start, cam names to stop) when node's share changes
+
+    first assignment is made after cluster_dead_after sec, when alive peers are already known;
+    on_assign is called in own thread (it may wait for cams to stop), so heartbeats are not delayed
+    """
+
+    def __init__(self, node_id: str, nodes: Dict[str, Tuple[str, int]], cam_names: List[str],
+                 on_assign: Callable[[List[str], List[str]], None]):
+        super().__init__(name='ClusterNode', daemon=True)
+        node_index(node_id, nodes)  # ValueError if node is not configured
+        self.node_id: str = node_id
+        self.nodes: Dict[str, Tuple[str, int]] = nodes  # node id -> heartbeat (host, udp port)
+        self.cam_names: List[str] = cam_names
+        self._on_assign = on_assign
+        self._last_seen: Dict[str, float] = {}  # peer node id -> monotonic time of last heartbeat
+        self.alive: Set[str] = set()
+        self.assigned: Set[str] = set()  # cam names served by this node
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(nodes[node_id])
+        self._sock.settimeout(cfg['cluster_heartbeat_interval'])
+        self._stop_event = threading.Event()
+        self._seq: int = 0
+        self._assignments = queue.Queue()  # (to_start, to_stop) for assigner thread, None - stop
+        self._assigner = threading.Thread(target=self._assign_loop, name='ClusterAssigner', daemon=True)
+
+    def run(self):
+        self._assigner.start()
+        started = time.monotonic()
+        next_beat = 0.0
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            if now >= next_beat:
+                self._send_heartbeats()
+                next_beat = now + cfg['cluster_heartbeat_interval']
+            self._receive()
+            if time.monotonic() - started >= cfg['cluster_dead_after']:
+                self._rebalance()
+        self._sock.close()
+        self._assignments.put(None)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _assign_loop(self):
+        while True:
+            item = self._assignments.get()
+            if item is None:
+                break
+            try:
+                self._on_assign(*item)
+            except Exception:
+                logging.exception(f"Cluster assignment {item} failed")
+
+    def _send_heartbeats(self):
+        self._seq += 1
+        msg = json.dumps({'node': self.node_id, 'seq': self._seq, 'cams': len(self.assigned)}).encode()
+        for node_id, addr in self.nodes.items():
+            if node_id != self.node_id:
+                try:
+                    self._sock.sendto(msg, addr)
+                except OSError:
+                    pass  # peer host is unreachable: it's dead for us
+
+    def _receive(self):
+        try:
+            data, _ = self._sock.recvfrom(1024)
+        except socket.timeout:
+            return
+        except OSError:  # e.g. icmp port unreachable from dead peer
+            return
+        try:
+            node_id = json.loads(data)['node']
+        except (ValueError, KeyError):
+            return
+        if node_id in self.nodes:
+            self._last_seen[node_id] = time.monotonic()
+
+    def _rebalance(self):
+        now = time.monotonic()
+        alive = {self.node_id} | {n for n, t in self._last_seen.items() if now - t < cfg['cluster_dead_after']}
+        if alive == self.alive:
+            return
+        logging.info(f"Cluster nodes alive: {sorted(alive)} (were {sorted(self.alive)})")
+        self.alive = alive
+        ring = HashRing(sorted(alive))
+        mine = {name for name in self.cam_names if ring.node_for(name) == self.node_id}
+        to_start, to_stop = sorted(mine - self.assigned), sorted(self.assigned - mine)
+        self.assigned = mine
+        if to_start or to_stop:
+            self._assignments.put((to_start, to_stop))
+
+
+def encode_frame(node: int, cam_id: int, frame_time: float, image: np.ndarray, codec: str = 'jpeg',
+                 jpeg_quality: int = 80) -> bytes:
+    h, w = image.shape[:2]
+    c = image.shape[2] if image.ndim == 3 else 1
+    if codec == 'jpeg':
+        payload = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])[1].tobytes()
+    else:
+        payload = np.ascontiguousarray(image).tobytes()
+    return HEADER.pack(MAGIC, MSG_FRAME, CODECS[codec], node, cam_id, frame_time, h, w, c,
+                       image.dtype.str.encode(), len(payload)) + payload
+
+
+def encode_event(node: int, event) -> bytes:
+    payload = json.dumps({'kind': event.kind, 'track_id': event.track_id, 'box': list(event.box)}).encode()
+    return HEADER.pack(MAGIC, MSG_EVENT, CODEC_JSON, node, event.cam_id, event.time, 0, 0, 0, b'', len(payload)) \
+        + payload
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray(size)
+    view, got = memoryview(buf), 0
+    while got < size:
+        n = sock.recv_into(view[got:])
+        if not n:
+            raise ConnectionError('connection closed')
+        got += n
+    return bytes(buf)
+
+
+def read_message(sock: socket.socket) -> Tuple[Dict, object]:
+    """ next relay message: (header fields, payload) - payload is image for frames, dict for events """
+    magic, msg_type, codec, node, cam_id, frame_time, h, w, c, dtype, length = HEADER.unpack(
+        _recv_exact(sock, HEADER.size))
+    if magic != MAGIC:
+        raise ValueError(f"bad relay message magic {magic}")
+    payload = _recv_exact(sock, length)
+    header = {'type': msg_type, 'node': node, 'cam_id': cam_id, 'time': frame_time}
+    if codec == CODEC_JSON:
+        return header, json.loads(payload)
+    if codec == CODEC_JPEG:
+        return header, cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_UNCHANGED)
+    shape = (h, w, c) if c > 1 else (h, w)
+    return header, np.frombuffer(payload, dtype.rstrip(b'\0').decode()).reshape(shape)
+
+
+class FrameRelay(threading.Thread):
+    """ sends frames and events to aggregator: bounded queue (new messages are dropped if full), reconnects """
+
+    def __init__(self, addr: Tuple[str, int], node: int, codec: str = 'jpeg', jpeg_quality: int = 80,
+                 queue_size: int = 64):
+        super().__init__(name='FrameRelay', daemon=True)
+        self.addr: Tuple[str, int] = addr
+        self.node: int = node  # node index (in cluster_nodes) sent in each message
+        self.codec: str = codec
+        self.jpeg_quality: int = jpeg_quality
+        self._queue = queue.Queue(queue_size)
+        self._sock: socket.socket = None
+        self.sent: int = 0
+        self.dropped: int = 0
+
+    def send_frame(self, frame) -> bool:
+        """ queue frame (it's retained till encoded), return False if dropped """
+        return self._put(frame.retain(), frame.release)
+
+    def send_event(self, event) -> bool:
+        return self._put(event)
+
+    def _put(self, item, on_drop=None) -> bool:
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            if on_drop:
+                on_drop()
+            return False
+        return True
+
+    def stop(self):
+        self._queue.put(None)
+
+    def run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if hasattr(item, 'image'):  # frame
+                try:
+                    msg = encode_frame(self.node, item.cam_id, item.time, item.image, self.codec, self.jpeg_quality)
+                finally:
+                    item.release()
+            else:
+                msg = encode_event(self.node, item)
+            self._send(msg)
+        if self._sock is not None:
+            self._sock.close()
+
+    def _send(self, msg: bytes):
+        """ send message, reconnect once on error; message is dropped if aggregator is unavailable """
+        for _ in range(2):
+            try:
+                if self._sock is None:
+                    self._sock = socket.create_connection(self.addr, timeout=cfg['cluster_relay_timeout'])
+                    self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self._sock.sendall(msg)
+                self.sent += 1
+                return
+            except OSError as e:
+                logging.debug(f"Relay to {self.addr}: {e}")
+                if self._sock is not None:
+                    self._sock.close()
+                    self._sock = None
+        self.dropped += 1
+
+
+class _AggregatorHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        while True:
+            try:
+                header, payload = read_message(self.request)
+            except (ConnectionError, OSError, ValueError):
+                return
+            if header['type'] == MSG_FRAME:
+                self.server.on_frame(header, payload)
+            else:
+                self.server.on_event(header, payload)
+
+
+class _AggregatorServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class FrameAggregator(threading.Thread):
+    """ receives relayed frames and events from nodes: on_frame(header, image), on_event(header, event dict) """
+
+    def __init__(self, addr: Tuple[str, int], on_frame: Callable, on_event: Callable):
+        super().__init__(name='FrameAggregator', daemon=True)
+        self._server = _AggregatorServer(addr, _AggregatorHandler)
+        self._server.on_frame, self._server.on_event = on_frame, on_event
+        self.addr: Tuple[str, int] = self._server.server_address
+
+    def run(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, style='{', format='{threadName:22s}:{message}')
+    host, port = cfg['cluster_relay'] or ('127.0.0.1', 9300)
+    counts: Dict[Tuple[int, int], int] = {}
+
+    def on_frame(header, image):
+        key = (header['node'], header['cam_id'])
+        counts[key] = counts.get(key, 0) + 1
+
+    aggregator = FrameAggregator((host, port), on_frame, lambda header, event: logging.info(f"{header} {event}"))
+    aggregator.start()
+    while True:  # frames received from (node, cam) every 10 sec
+        time.sleep(10)
+        logging.info(f"Frames (node, cam_id): {counts}")
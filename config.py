@@ -15,12 +15,104 @@ _folders = {
 cfg = {
     'camera_info_file' : _folders['data'] + 'cameras_info.csv',
     'camera_frames_que_size' : 10, # frames queue size for each cam
+    'camera_priority' : 1, # default for 'priority' column: frames taken from cam per round-robin turn
+    'camera_target_fps' : 0.0, # default for 'fps' column: frames delivered per sec (others are not decoded), 0 - all
+    'camera_backend' : 'any', # default for 'backend' column: any | ffmpeg | gstreamer
+    'camera_decode_threads' : 0, # default for 'threads' column: decoder threads (CAP_PROP_N_THREADS), 0 - default
+    'camera_transport' : '', # rtsp transport tcp | udp ('' - tcp) of decoded cams (site-wide ffmpeg option), default for 'transport' column (passthrough)
+    'camera_buffer_size' : 0, # default for 'buffer_size' column: backend frames buffer, 0 - backend default
+    'camera_low_latency' : False, # no ffmpeg demuxer buffering for all decoded cams (site-wide ffmpeg option)
+    'camera_latency_mode' : 'all', # default for 'latency' column: all - every frame | newest - skip buffered frames
+    'camera_drain_grab_time' : 0.005, # 'newest' mode: grab faster than this (sec) means frame was buffered
+    'camera_drain_max' : 50, # 'newest' mode: max buffered frames skipped at once
+    'calibration_db' : None, # MyDb params (+'backend': mysql|sqlite) of cams calibrations, None - not used
+    'calibration_ttl' : 600.0, # sec to keep calibration in cache before reload
+    'camera_overflow_policy' : 'drop-oldest', # default for 'overflow' column: drop-oldest | drop-newest | block
+    'frame_bus_timeout' : 1.0, # max wait (sec) for blocking put/get on frames queue
+    'frame_pool_max_free' : 64, # max free image buffers kept in frame pool for each shape
+    'ingest_mode' : 'threads', # threads: CamWorker thread per cam; async: asyncio scheduler over thread pool
+    'ingest_executor_workers' : 8, # thread pool size for blocking capture calls in 'async' mode
+    'ingest_backoff_min' : 1.0, # first reconnect delay (sec), doubled on each failure
+    'ingest_backoff_max' : 30.0, # max reconnect delay (sec)
+    'ingest_backoff_jitter' : 0.5, # reconnect delay is randomly reduced by up to this part (cams don't retry at once)
+    'camera_open_timeout' : 10.0, # sec to wait for cam to open, then retry later
+    'camera_read_timeout' : 10.0, # sec to wait for frame from opened cam (ffmpeg backend), then reconnect
+    'supervisor_check_interval' : 1.0, # sec between checks of capture workers
+    'supervisor_stall_timeout' : 30.0, # online cam worker without progress this long (sec) is replaced by new one
+    'supervisor_stop_timeout' : 5.0, # sec to wait for each capture worker to stop
+    'processing_mode' : 'thread', # thread: one FrameProcessor thread; process: pool of worker processes
+    'processing_procs' : 2, # worker processes for 'process' mode (each cam is served by one of them)
+    'processing_shm_slots' : 4, # shared memory frame slots for each cam in 'process' mode
+    'processing_metrics_interval' : 1.0, # sec between metrics sent from worker processes to main one
+    'snapshot_thumb_width' : 320, # default width of cam snapshot thumbnails
+    'snapshot_jpeg_quality' : 80, # JPEG quality of cam snapshot thumbnails
+    'detect_persons' : False, # run person detector on input frames
+    'motion_gate' : True, # pass to detector only frames with motion (see motion.py)
+    'motion_sensitivity' : 0.002, # default for 'motion' column: changed part of ROI to detect motion, 0 - no gate
+    'motion_width' : 160, # frames are downscaled to this width for motion detection
+    'motion_pixel_threshold' : 25, # min gray level difference of changed pixel
+    'motion_learning_rate' : 0.05, # background running average weight of new frame
+    'motion_hold' : 2.0, # sec to keep passing frames to detector after motion stops
+    'detector_model' : _folders['data'] + 'MobileNetSSD_deploy.caffemodel', # SSD-style model for cv2.dnn
+    'detector_config' : _folders['data'] + 'MobileNetSSD_deploy.prototxt',
+    'detector_input_size' : (300, 300),
+    'detector_scale' : 1 / 127.5,
+    'detector_mean' : (127.5, 127.5, 127.5),
+    'detector_swap_rb' : False,
+    'detector_person_class' : 15, # 'person' class id of the model
+    'detector_confidence' : 0.5, # min confidence of person box
+    'detector_nms_iou' : 0.45, # person boxes overlapping more confident box more than this are suppressed
+    'detector_batch_size' : 8, # max frames (from all cams) in one forward pass
+    'detector_max_wait' : 0.05, # max wait (sec) for batch to fill up
+    'detector_queue_size' : 32, # frames waiting for detection; new frames are dropped if full
+    'detect_every_n_frames' : 1, # pass to detector every Nth frame of cam, tracks are predicted in between
+    'tracker_min_iou' : 0.2, # min IoU of track and detected box to match them
+    'tracker_min_hits' : 3, # detections to confirm track ('enter' event)
+    'tracker_max_age' : 2.0, # sec without detections to drop track ('exit' event)
+    'tracker_process_noise' : 10.0, # Kalman process noise (per sec)
+    'tracker_measurement_noise' : 10.0, # Kalman measurement noise (pixels^2)
+    'dwell_time' : 60.0, # 'dwell' event for every dwell_time sec of track life
+    'log_level' : 'INFO', # vsrv logging level (DEBUG logs every frame and slows down processing)
+    'metrics_log_interval' : 60.0, # sec between metrics summaries in log, 0 - no summaries
+    'metrics_host' : '127.0.0.1', # metrics http endpoint (Prometheus text format: GET /metrics)
+    'metrics_port' : 9108, # None - no metrics endpoint; in cluster mode + node index in cluster_nodes
+    'dashboard' : False, # show cams status table in terminal (see dashboard.py)
+    'dashboard_hz' : 2.0, # dashboard refreshes per sec
+    'cluster_node' : os.environ.get('VINT_NODE'), # id of this node (key of cluster_nodes), None - no cluster
+    'cluster_nodes' : {}, # node id -> (host, udp port) for heartbeats; all nodes have the same cameras_info.csv
+    'cluster_heartbeat_interval' : 0.5, # sec between heartbeats to peers
+    'cluster_dead_after' : 3.0, # node without heartbeats this long (sec) is dead, its cams are taken over
+    'cluster_relay' : None, # aggregator (host, tcp port) to forward frames and events to, None - no relay
+    'cluster_relay_codec' : 'jpeg', # jpeg | raw
+    'cluster_relay_every_n' : 25, # forward every Nth frame of cam (0 - only events)
+    'cluster_relay_timeout' : 2.0, # sec to connect/send to aggregator
+    'load_shedding' : False, # degrade processing under overload (see load_shedder.py)
+    'shed_check_interval' : 1.0, # sec between load checks
+    'shed_queue_high' : 0.75, # overloaded if fullest frame bus ring is filled more (0..1)
+    'shed_queue_low' : 0.25, # calm if all rings are filled less
+    'shed_latency_high' : 1.0, # overloaded if p95 grab-to-processed latency is more (sec)
+    'shed_latency_low' : 0.3, # calm if p95 latency is less (sec)
+    'shed_raise_after' : 3, # overloaded checks in a row to shed next action
+    'shed_restore_after' : 10, # calm checks in a row to restore last shed action
+    'shed_levels' : ['display', 'low_priority', 'downscale', 'detection'], # actions in order of shedding
+    'shed_priority_below' : 0, # cams with lower 'priority' are throttled by 'low_priority' action, 0 - none
+    'shed_low_priority_fps' : 1.0, # target fps of throttled cams
+    'shed_downscale' : 0.5, # frames size factor of 'downscale' action
     'show_frames' : False, # display input frames from cameras
     'write_frames' : True, # write input frames to video files (separated by cam)
     'write_frames_folder' : _folders['video'],
     'write_frames_fps' : 3.0, # fps for videofiles that save cam frame stream
     'write_frames_four_cc' :cv2.VideoWriter_fourcc( *'XVID'), # four_cc for videofiles
     'write_frames_suffix' : '.avi',
+    'write_segment_minutes' : 10, # start new videofile (segment) for cam every N minutes
+    'camera_record_mode' : 'encode', # default for 'record' column: encode (decoded frames) | passthrough | none
+    'passthrough_ffmpeg' : 'ffmpeg', # ffmpeg executable for passthrough recording
+    'passthrough_suffix' : '.mkv', # segment files of passthrough recording
+    'passthrough_restart_delay' : 5.0, # sec to wait before restarting broken passthrough recording
+    'passthrough_stop_timeout' : 5.0, # sec to wait for ffmpeg to finalize segment on stop (then it's killed)
+    'write_frames_queue_size' : 30, # frames waiting for encoding (for each cam); new frames are dropped if full
+    'write_frames_batch' : 8, # max frames written by encoder thread at one wake-up
+    'write_frames_stop_timeout' : 10.0, # sec to wait for encoder to write queued frames on stop
     # 'max_reread_attempt' : 1000, # how many times to reread frame from cam (interval=1 sec) if stream is broken
     # 'frame_storage_size' : 30,
 }
@@ -0,0 +1,90 @@
+""" dashboard.py - live cams status table in terminal (ANSI escapes, as old CamStat)
+
+Table is refreshed dashboard_hz times per sec from live counters (Metrics and its gauges, frame bus, cams),
+only changed rows are redrawn, in one write. Cursor is saved/restored, so log output is not moved.
+"""
+
+import sys
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from camera import Camera
+from metrics import Metrics
+
+_HEADER = f"{'Id':>4s} {'Name':12s} {'fps':>6s} {'decode':>8s} {'queue':>5s} {'drops':>7s} {'reconn':>6s} " \
+          f"{'wr.queue':>8s} {'wr.drop':>7s} Status"
+
+
+class Dashboard(threading.Thread):
+    """ status table of cams at (x0, y0) of terminal """
+
+    def __init__(self, cams: List[Camera], frame_bus, hz: float, left_top_corner_xy: Tuple[int, int] = (1, 1),
+                 out=sys.stdout):
+        super().__init__(name='Dashboard', daemon=True)
+        self.cams: List[Camera] = cams
+        self._bus = frame_bus
+        self.interval: float = 1.0 / hz
+        self.x0, self.y0 = left_top_corner_xy
+        self._out = out
+        self._rows: Dict[int, str] = {}  # cam_id -> last drawn row
+        self._prev: Dict[int, Tuple[float, int, int, float]] = {}  # cam_id -> (time, frames, decodes, decode sum)
+        self._stop_event = threading.Event()
+
+    def run(self):
+        self._out.write(self.esc_seq_clear() + self._at(0, _HEADER) + self._at(1, '-' * len(_HEADER))
+                        + self.esc_seq_xy((1, self.y0 + 2 + len(self.cams))))  # log goes below the table
+        self._out.flush()
+        while not self._stop_event.wait(self.interval):
+            self.refresh()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def refresh(self):
+        """ redraw rows which have changed since last refresh """
+        gauges = Metrics.gauges()  # writer_* gauges come from workers too in 'process' processing mode
+        changed = []
+        for i, cam in enumerate(self.cams):
+            row = self._row(cam, gauges)
+            if self._rows.get(cam.cam_id) != row:
+                self._rows[cam.cam_id] = row
+                changed.append(self._at(2 + i, row))
+        if changed:
+            self._out.write(self.esc_seq_save_cursor() + ''.join(changed) + self.esc_seq_restore_cursor())
+            self._out.flush()
+
+    def _row(self, cam: Camera, gauges: Dict[str, float]) -> str:
+        now = time.monotonic()
+        frames = Metrics.counter('frames', cam.cam_name)
+        hist = Metrics.histogram('decode', cam.cam_name)
+        decodes, decode_sum = (hist.total, hist.sum) if hist is not None else (0, 0.0)
+        prev_time, prev_frames, prev_decodes, prev_sum = self._prev.get(cam.cam_id, (now, frames, decodes, decode_sum))
+        self._prev[cam.cam_id] = (now, frames, decodes, decode_sum)
+        fps = (frames - prev_frames) / (now - prev_time) if now > prev_time else 0.0
+        decode_ms = 1000 * (decode_sum - prev_sum) / (decodes - prev_decodes) if decodes > prev_decodes else 0.0
+        status = cam.health if cam.decode else 'off'  # see supervisor.py
+        label = f'{{cam="{cam.cam_name}"}}'
+        return f"{cam.cam_id:4d} {cam.cam_name[:12]:12s} {fps:6.1f} {decode_ms:6.1f}ms " \
+               f"{self._bus.qsize(cam.cam_id):5d} {Metrics.counter('dropped', cam.cam_name):7d} " \
+               f"{cam.reconnects:6d} {int(gauges.get(f'writer_queue{label}', 0)):8d} " \
+               f"{int(gauges.get(f'writer_dropped{label}', 0)):7d} {status:10s}"
+
+    def _at(self, line: int, text: str) -> str:
+        return f"{self.esc_seq_xy((self.x0, self.y0 + line))}{text}\033[K"  # text, then clear rest of line
+
+    @staticmethod
+    def esc_seq_xy(xy: Tuple[int, int]):
+        return f"\033[{xy[1]};{xy[0]}f"
+
+    @staticmethod
+    def esc_seq_clear():
+        return "\033[2J"
+
+    @staticmethod
+    def esc_seq_save_cursor():
+        return "\033[s"
+
+    @staticmethod
+    def esc_seq_restore_cursor():
+        return "\033[u"
@@ -1,20 +1,109 @@
 """ Detector: Frame --> PersBoxedFrame
+
+Frames from several cams are collected into batches and go through one DNN forward pass (OpenCV DNN on CPU).
 """
 
-from typing import Tuple
+import logging
+import queue
+import threading
+import time
+from typing import Callable, List
 
-import numpy as np
 import cv2
 
-from boxes import Box,PersBox,PersBoxLst
+from config import cfg
+from boxes import PersBoxLst
 
 class PersBoxedFrame:
     """ Frame + PersBoxList
     """
-    def __init__(self):
-        pass
+    def __init__(self, frame, pers_boxes: PersBoxLst):
+        self.frame = frame
+        self.cam_id: int = frame.cam_id
+        self.pers_boxes: PersBoxLst = pers_boxes
+
+    def __str__(self):
+        return f"PersBoxedFrame({self.frame},{self.pers_boxes})"
+
+
+class Detector(threading.Thread):
+    """ batched person detector: submit(frame) --> on_result(PersBoxedFrame)
+
+    batch is closed when it has detector_batch_size frames or detector_max_wait passed since its first frame
+    """
+    def __init__(self, on_result: Callable[[PersBoxedFrame], None]):
+        super().__init__(name='Detector')
+        self._on_result = on_result
+        self._net = self.load_net()
+        self._queue = queue.Queue(cfg['detector_queue_size'])
+        self.dropped: int = 0  # frames not accepted because detector is busy
+        self.batches: int = 0
+        self.frames: int = 0
+
+    @staticmethod
+    def load_net():
+        """ DNN from detector_model/detector_config files (raises cv2.error if they are missing or bad) """
+        net = cv2.dnn.readNet(cfg['detector_model'], cfg['detector_config'])
+        net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        return net
+
+    def submit(self, frame) -> bool:
+        """ queue frame for detection (frame is retained till detected), return False if frame is dropped """
+        try:
+            self._queue.put_nowait(frame.retain())
+        except queue.Full:
+            frame.release()
+            self.dropped += 1
+            return False
+        return True
+
+    def stop(self):
+        self._queue.put(None)
 
+    def run(self):
+        stopped = False
+        while not stopped:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + cfg['detector_max_wait']
+            while batch[-1] is not None and len(batch) < cfg['detector_batch_size']:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                stopped = True
+                batch.pop()
+            if batch:
+                self._process_batch(batch)
+        logging.debug(f"Detector stopped: {self.frames} frames in {self.batches} batches, dropped {self.dropped}")
 
-class Detector:
-    pass
+    def _process_batch(self, frames: List):
+        try:
+            for result in self.detect(frames):
+                self._on_result(result)
+        except Exception:
+            logging.exception(f"Detection failed for batch of {len(frames)} frames")
+        finally:
+            for frame in frames:
+                frame.release()
 
+    def detect(self, frames: List) -> List[PersBoxedFrame]:
+        """ one forward pass for all frames """
+        blob = cv2.dnn.blobFromImages([frame.image for frame in frames], cfg['detector_scale'],
+                                      cfg['detector_input_size'], cfg['detector_mean'], cfg['detector_swap_rb'])
+        self._net.setInput(blob)
+        detections = self._net.forward().reshape(-1, 7)  # SSD output: image_id, class, confidence, x1,y1,x2,y2
+        detections = detections[(detections[:, 1] == cfg['detector_person_class']) &
+                                (detections[:, 2] >= cfg['detector_confidence'])]
+        self.batches += 1
+        self.frames += len(frames)
+        results = []
+        for i, frame in enumerate(frames):
+            h, w = frame.image.shape[:2]
+            w, h = round(w / frame.scale), round(h / frame.scale)  # boxes in cam frame size (image may be downscaled)
+            dets = detections[detections[:, 0] == i]
+            pers_boxes = PersBoxLst.from_arrays(dets[:, 3:7] * (w, h, w, h), dets[:, 2])
+            pers_boxes = pers_boxes.clip(w, h).nms(cfg['detector_nms_iou'])
+            results.append(PersBoxedFrame(frame, pers_boxes))
+        return results
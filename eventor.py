@@ -1,2 +1,187 @@
 """ Eventor:  PersBoxedFrame --> Events
-"""
\ No newline at end of file
+
+Per-cam tracker links person boxes across frames (Kalman constant-velocity motion model + IoU assignment)
+and gives them stable track ids. Between detections (detector runs on every Nth frame) tracks are predicted.
+Events: 'enter' (track confirmed), 'exit' (track lost), 'dwell' (track stays for every dwell period).
+"""
+
+import logging
+import threading
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from config import cfg
+from boxes import PersBoxLst
+from detector import PersBoxedFrame
+
+try:
+    from scipy.optimize import linear_sum_assignment  # Hungarian assignment if scipy is installed
+except ImportError:
+    linear_sum_assignment = None
+
+
+class Event:
+    """ person event at cam """
+    def __init__(self, kind: str, cam_id: int, track_id: int, time: float, box: Tuple[int, int, int, int]):
+        self.kind: str = kind  # enter | exit | dwell
+        self.cam_id: int = cam_id
+        self.track_id: int = track_id
+        self.time: float = time
+        self.box: Tuple[int, int, int, int] = box  # x_ul,y_ul,x_br,y_br
+
+    def __str__(self):
+        return f"Event({self.kind},cam={self.cam_id},track={self.track_id},{self.time:.3f},{self.box})"
+
+
+class Track:
+    """ one tracked person: Kalman filter over (cx, cy, w, h) and their velocities """
+    _next_id: int = 1
+    _H = np.hstack([np.eye(4), np.zeros((4, 4))])  # measurement: box (cx,cy,w,h)
+
+    def __init__(self, box: np.ndarray, time: float):
+        self.track_id: int = Track._next_id
+        Track._next_id += 1
+        self.x: np.ndarray = np.concatenate([self._to_cxcywh(box), np.zeros(4)])
+        self.P: np.ndarray = np.diag([10.0] * 4 + [1000.0] * 4)  # unknown velocity at start
+        self.time: float = time  # time of state
+        self.first_seen: float = time
+        self.last_seen: float = time
+        self.hits: int = 1
+        self.confirmed: bool = False
+        self.dwells: int = 0  # dwell events reported
+
+    @staticmethod
+    def _to_cxcywh(box: np.ndarray) -> np.ndarray:
+        x1, y1, x2, y2 = box
+        return np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1], float)
+
+    def box(self) -> np.ndarray:
+        cx, cy, w, h = self.x[:4]
+        return np.array([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2])
+
+    def predict(self, time: float):
+        dt = max(0.0, time - self.time)  # late results (older than state) are not rolled back
+        if not dt:
+            return
+        F = np.eye(8)
+        F[:4, 4:] = np.eye(4) * dt
+        self.x = F @ self.x
+        self.x[2:4] = np.maximum(self.x[2:4], 1.0)
+        self.P = F @ self.P @ F.T + np.eye(8) * cfg['tracker_process_noise'] * dt
+        self.time = time
+
+    def update(self, box: np.ndarray, time: float):
+        R = np.eye(4) * cfg['tracker_measurement_noise']
+        S = self._H @ self.P @ self._H.T + R
+        K = self.P @ self._H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ (self._to_cxcywh(box) - self._H @ self.x)
+        self.P = (np.eye(8) - K @ self._H) @ self.P
+        self.last_seen = max(self.last_seen, time)
+        self.hits += 1
+
+
+def _associate(iou: np.ndarray, min_iou: float) -> List[Tuple[int, int]]:
+    """ (track, detection) pairs maximizing IoU """
+    if not iou.size:
+        return []
+    if linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(-iou)
+    else:  # greedy: best remaining pair first
+        rows, cols = [], []
+        for flat in np.argsort(-iou, axis=None):
+            r, c = np.unravel_index(flat, iou.shape)
+            if r not in rows and c not in cols:
+                rows.append(r)
+                cols.append(c)
+    return [(int(r), int(c)) for r, c in zip(rows, cols) if iou[r, c] >= min_iou]
+
+
+class CamTracker:
+    """ tracks of one cam; update() on detections, predict() on frames between detections """
+
+    def __init__(self, cam_id: int):
+        self.cam_id: int = cam_id
+        self.tracks: List[Track] = []
+        self._lock = threading.Lock()  # update from Detector thread, predict from frame processing
+
+    def update(self, pers_boxes: PersBoxLst, time: float) -> List[Event]:
+        events = []
+        with self._lock:
+            for track in self.tracks:
+                track.predict(time)
+            det_boxes = pers_boxes.coords()
+            track_boxes = PersBoxLst.from_arrays(np.array([t.box() for t in self.tracks]), 0.0)
+            pairs = _associate(track_boxes.iou_matrix(pers_boxes), cfg['tracker_min_iou'])
+            matched_dets = set()
+            for ti, di in pairs:
+                track = self.tracks[ti]
+                track.update(det_boxes[di], time)
+                matched_dets.add(di)
+                if not track.confirmed and track.hits >= cfg['tracker_min_hits']:
+                    track.confirmed = True
+                    events.append(self._event('enter', track, time))
+            for di in range(len(det_boxes)):
+                if di not in matched_dets:
+                    self.tracks.append(Track(det_boxes[di], time))
+            events += self._check_tracks(time)
+        return events
+
+    def predict(self, time: float) -> Tuple[Dict[int, np.ndarray], List[Event]]:
+        """ interpolated boxes of confirmed tracks at time: track_id -> (x_ul,y_ul,x_br,y_br); exit/dwell events """
+        with self._lock:
+            for track in self.tracks:
+                track.predict(time)
+            events = self._check_tracks(time)
+            return {t.track_id: t.box() for t in self.tracks if t.confirmed}, events
+
+    def _check_tracks(self, time: float) -> List[Event]:
+        """ drop lost tracks (exit events), report dwelling ones """
+        events = []
+        alive = []
+        for track in self.tracks:
+            if time - track.last_seen > cfg['tracker_max_age']:
+                if track.confirmed:
+                    events.append(self._event('exit', track, time))
+                continue
+            if track.confirmed and time - track.first_seen >= cfg['dwell_time'] * (track.dwells + 1):
+                track.dwells += 1
+                events.append(self._event('dwell', track, time))
+            alive.append(track)
+        self.tracks = alive
+        return events
+
+    def _event(self, kind: str, track: Track, time: float) -> Event:
+        return Event(kind, self.cam_id, track.track_id, time, tuple(int(v) for v in track.box()))
+
+
+class Eventor:
+    """ PersBoxedFrame --> per-cam tracker --> events to handlers """
+    _trackers: Dict[int, CamTracker] = {}
+    handlers: List[Callable[[Event], None]] = [lambda event: logging.info(f"{event}")]
+
+    @classmethod
+    def tracker(cls, cam_id: int) -> CamTracker:
+        tracker = cls._trackers.get(cam_id)
+        if tracker is None:
+            tracker = cls._trackers.setdefault(cam_id, CamTracker(cam_id))
+        return tracker
+
+    @classmethod
+    def on_pers_boxed_frame(cls, pbf: PersBoxedFrame) -> List[Event]:
+        events = cls.tracker(pbf.cam_id).update(pbf.pers_boxes, pbf.frame.time)
+        cls._emit(events)
+        return events
+
+    @classmethod
+    def predict(cls, frame) -> Dict[int, np.ndarray]:
+        """ tracks of frame cam interpolated to frame time (for frames not passed to detector) """
+        boxes, events = cls.tracker(frame.cam_id).predict(frame.time)
+        cls._emit(events)
+        return boxes
+
+    @classmethod
+    def _emit(cls, events: List[Event]):
+        for event in events:
+            for handler in cls.handlers:
+                handler(event)
@@ -0,0 +1,159 @@
+""" frame_bus.py - blocking frame queue between CamWorkers (put) and FrameProcessor (get)
+
+Every camera has its own bounded ring buffer, so a stalled or fast camera can't starve the others.
+FrameProcessor drains rings round-robin, taking up to <weight> frames from a camera per turn.
+"""
+
+import threading
+from typing import Callable, Dict, List, Optional
+
+DROP_OLDEST = 'drop-oldest'  # ring is full: drop the oldest queued frame, put the new one
+DROP_NEWEST = 'drop-newest'  # ring is full: drop the new frame
+BLOCK = 'block'  # ring is full: wait (up to timeout) till FrameProcessor takes something from this cam
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+
+class FrameRing:
+    """ preallocated ring buffer of frame slots for one camera (not thread-safe, guarded by FrameBus lock) """
+
+    def __init__(self, size: int, weight: int = 1):
+        self.slots: List = [None] * size
+        self.size: int = size
+        self.weight: int = max(1, weight)  # frames taken from this ring per round-robin turn
+        self.head: int = 0  # index of the oldest frame
+        self.count: int = 0
+        self.dropped: int = 0
+
+    def __str__(self):
+        return f"FrameRing({self.count}/{self.size},w={self.weight},dropped={self.dropped})"
+
+    def full(self) -> bool:
+        return self.count == self.size
+
+    def push(self, frame):
+        self.slots[(self.head + self.count) % self.size] = frame
+        self.count += 1
+
+    def pop(self):
+        frame = self.slots[self.head]
+        self.slots[self.head] = None
+        self.head = (self.head + 1) % self.size
+        self.count -= 1
+        return frame
+
+
+class FrameBus:
+    """ per-camera bounded frame rings with blocking get/put, per-put overflow policy and dropped frames counters
+
+    close() wakes up all waiting producers/consumers, so threads don't have to poll stop flag.
+    Frame not accepted by put() stays with caller; queued frame dropped by DROP_OLDEST is passed to on_drop.
+    """
+
+    def __init__(self, ring_size: int, on_drop: Callable = None):
+        self.ring_size: int = ring_size  # default ring size for cameras added without explicit size
+        self._on_drop: Callable = on_drop
+        self._rings: Dict[int, FrameRing] = {}
+        self._order: List[int] = []  # round-robin order of cam_ids
+        self._rr_pos: int = 0  # current position in round-robin order
+        self._rr_credit: int = 0  # frames left to take from current ring in this turn
+        self._total: int = 0  # frames in all rings
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full: Dict[int, threading.Condition] = {}
+        self._closed: bool = False
+
+    def __str__(self):
+        return f"FrameBus({self._total} frames,{ {cam_id: str(r) for cam_id, r in self._rings.items()} })"
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def dropped(self) -> Dict[int, int]:
+        """ cam_id -> dropped frames counter """
+        return {cam_id: ring.dropped for cam_id, ring in self._rings.items()}
+
+    def add_cam(self, cam_id: int, weight: int = 1, size: int = None):
+        """ register camera ring; weight - frames taken from this cam per round-robin turn """
+        with self._lock:
+            self._rings[cam_id] = FrameRing(size or self.ring_size, weight)
+            self._not_full[cam_id] = threading.Condition(self._lock)
+            self._order.append(cam_id)
+            if len(self._order) == 1:
+                self._rr_credit = self._rings[cam_id].weight
+
+    def qsize(self, cam_id: int = None) -> int:
+        """ frames queued for cam_id (all cams if cam_id is None) """
+        return self._total if cam_id is None else self._rings[cam_id].count
+
+    def fill(self) -> float:
+        """ fill ratio (0..1) of the fullest ring """
+        with self._lock:
+            return max((ring.count / ring.size for ring in self._rings.values()), default=0.0)
+
+    def put(self, frame, policy: str = BLOCK, timeout: float = None) -> bool:
+        """ put frame, return True if frame is queued (False: frame dropped, timeout or bus closed) """
+        ring = self._rings[frame.cam_id]
+        not_full = self._not_full[frame.cam_id]
+        with self._lock:
+            if self._closed:
+                return False
+            if ring.full():
+                if policy == DROP_NEWEST:
+                    ring.dropped += 1
+                    return False
+                elif policy == DROP_OLDEST:
+                    oldest = ring.pop()
+                    ring.dropped += 1
+                    self._total -= 1
+                    if self._on_drop:
+                        self._on_drop(oldest)
+                else:
+                    ok = not_full.wait_for(lambda: self._closed or not ring.full(), timeout)
+                    if self._closed:
+                        return False
+                    if not ok:
+                        ring.dropped += 1
+                        return False
+            ring.push(frame)
+            self._total += 1
+            self._not_empty.notify()
+            return True
+
+    def get(self, timeout: float = None):
+        """ get next frame (round-robin over cams), wait up to timeout;
+        return None if timeout expired or bus is closed and empty
+        """
+        with self._not_empty:
+            if not self._not_empty.wait_for(lambda: self._closed or self._total, timeout):
+                return None
+            ring = self._next_ring()
+            if ring is None:  # closed and empty
+                return None
+            frame = ring.pop()
+            self._total -= 1
+            self._not_full[frame.cam_id].notify()
+            return frame
+
+    def _next_ring(self) -> Optional[FrameRing]:
+        """ weighted round-robin: stay on current ring while it has frames and credit, else go to next one """
+        n = len(self._order)
+        if not self._total:
+            return None
+        for _ in range(n + 1):
+            ring = self._rings[self._order[self._rr_pos]]
+            if ring.count and self._rr_credit > 0:
+                self._rr_credit -= 1
+                return ring
+            self._rr_pos = (self._rr_pos + 1) % n
+            self._rr_credit = self._rings[self._order[self._rr_pos]].weight
+        return None
+
+    def close(self):
+        """ stop accepting frames and wake up all waiting threads """
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            for not_full in self._not_full.values():
+                not_full.notify_all()
@@ -0,0 +1,61 @@
+""" frame_pool.py - pool of reusable image buffers, to avoid allocating new ndarray for every cam frame
+"""
+
+import collections
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from config import cfg
+
+
+class FramePool:
+    """ free image buffers keyed by (shape, dtype)
+
+    acquire() returns free buffer of requested shape (hit) or allocates new one (miss),
+    release() gives buffer back to pool (buffers over max_free per key are left to GC)
+    """
+
+    def __init__(self, max_free: int):
+        self.max_free: int = max_free  # max free buffers kept for each (shape,dtype)
+        self._free: Dict[Tuple, List[np.ndarray]] = collections.defaultdict(list)
+        self._lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.discarded: int = 0  # released buffers not kept because pool is full
+
+    def __str__(self):
+        return f"FramePool({self.stats()})"
+
+    def acquire(self, shape: Tuple, dtype=np.uint8) -> np.ndarray:
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            free = self._free[key]
+            if free:
+                self.hits += 1
+                return free.pop()
+            self.misses += 1
+        return np.empty(shape, dtype)
+
+    def release(self, buf: np.ndarray):
+        if buf is None:
+            return
+        key = (buf.shape, buf.dtype.str)
+        with self._lock:
+            free = self._free[key]
+            if len(free) < self.max_free:
+                free.append(buf)
+            else:
+                self.discarded += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': round(self.hits / total, 3) if total else 0.0,
+                    'discarded': self.discarded,
+                    'free': sum(len(lst) for lst in self._free.values())}
+
+
+frame_pool = FramePool(cfg['frame_pool_max_free'])
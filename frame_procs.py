@@ -0,0 +1,219 @@
+""" frame_procs.py - multi-process frame processing
+
+ProcFrameProcessor (thread in main process) takes frames from FrameBus, copies image into a slot of
+per-camera shared memory block and sends small handle (cam, shm name, slot, shape, dtype, time)
+to worker process. Image arrays are never pickled.
+Each camera is served by one worker process (cam_id % procs), so frame order per camera is preserved.
+Frame kept by handler after it returns (retain: encoder, detector, relay queues) is copied out of its slot,
+so slots are busy only while frames are processed. If all slots of cam are busy, its frame is dropped at once:
+dispatcher never waits for one cam.
+Workers send released slots and, every metrics_interval sec, their Metrics.delta() back by done queue.
+"""
+
+import logging
+import multiprocessing as mp
+import queue
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from frame_pool import frame_pool
+from metrics import Metrics
+
+_METRICS_MSG = '_metrics'  # done queue message (_METRICS_MSG, Metrics.delta()); others are (shm name, slot)
+
+
+class SharedFrame:
+    """ frame (same interface as vsrv.Frame) whose image is a view of shared memory slot
+
+    slot is returned to dispatcher when the last holder calls release(), or at first retain(): then image
+    is copied to frame_pool buffer (retain is called by handler thread before the frame is passed to others)
+    """
+    _refs_lock = threading.Lock()
+
+    def __init__(self, cam_id: int, cam_name: str, image: np.ndarray, frame_time: float, timestamp: str,
+                 slot_key: Tuple[str, int], done_queue, scale: float = 1.0):
+        self.cam_id: int = cam_id
+        self.cam_name: str = cam_name
+        self.time: float = frame_time
+        self.timestamp: str = timestamp
+        self.image: np.ndarray = image
+        self.scale: float = scale  # image size / cam frame size
+        self._slot_key: Tuple[str, int] = slot_key  # (shm name, slot)
+        self._done_queue = done_queue
+        self._refs: int = 1
+
+    def __str__(self):
+        return f"SharedFrame({self.cam_id},{self.cam_name},{self.timestamp})"
+
+    def retain(self) -> "SharedFrame":
+        if self._slot_key is not None:
+            self._detach()
+        with SharedFrame._refs_lock:
+            self._refs += 1
+        return self
+
+    def _detach(self):
+        """ move image from shared memory slot to frame_pool buffer, return the slot """
+        image = frame_pool.acquire(self.image.shape, self.image.dtype)
+        np.copyto(image, self.image)
+        self.image = image
+        self._done_queue.put(self._slot_key)
+        self._slot_key = None
+
+    def release(self):
+        with SharedFrame._refs_lock:
+            self._refs -= 1
+            if self._refs:
+                return
+        if self._slot_key is not None:
+            self._done_queue.put(self._slot_key)
+        else:
+            frame_pool.release(self.image)
+        self.image = None
+
+
+class CamSlots:
+    """ shared memory block of n_slots image slots for one camera """
+
+    def __init__(self, n_slots: int, slot_bytes: int):
+        self.slot_bytes: int = slot_bytes
+        self.shm = shared_memory.SharedMemory(create=True, size=n_slots * slot_bytes)
+        self.free: List[int] = list(range(n_slots))
+
+    def view(self, slot: int, shape: Tuple, dtype) -> np.ndarray:
+        return np.ndarray(shape, dtype, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _worker_main(in_queue, done_queue, handler: Callable, on_stop: Callable, metrics_interval: float):
+    """ worker process: attach slots by shm name, call handler for each frame """
+    attached: Dict[str, shared_memory.SharedMemory] = {}
+    Metrics.reset()  # forked copy of main process metrics
+    next_report = time.monotonic() + metrics_interval
+    while True:
+        try:
+            msg = in_queue.get(timeout=metrics_interval)
+        except queue.Empty:
+            msg = ()
+        if time.monotonic() >= next_report:
+            done_queue.put((_METRICS_MSG, Metrics.delta()))
+            next_report = time.monotonic() + metrics_interval
+        if msg is None:
+            break
+        if not msg:
+            continue
+        cam_id, cam_name, shm_name, slot, slot_bytes, shape, dtype, frame_time, timestamp, scale = msg
+        shm = attached.get(shm_name)
+        if shm is None:
+            shm = attached[shm_name] = shared_memory.SharedMemory(name=shm_name)
+        image = np.ndarray(shape, dtype, buffer=shm.buf, offset=slot * slot_bytes)
+        frame = SharedFrame(cam_id, cam_name, image, frame_time, timestamp, (shm_name, slot), done_queue, scale)
+        start = time.time()
+        try:
+            handler(frame)
+        except Exception:
+            logging.exception(f"Error while processing {frame}")
+        end = time.time()
+        Metrics.observe('process', cam_name, end - start)
+        Metrics.observe('latency', cam_name, end - frame_time)  # grab --> processed
+        frame.release()
+        del image
+    if on_stop:
+        on_stop()
+    done_queue.put((_METRICS_MSG, Metrics.delta()))  # incl. frames flushed by on_stop
+    for shm in attached.values():
+        shm.close()
+
+
+class ProcFrameProcessor(threading.Thread):
+    """ process main queue by pool of worker processes: take frames, pass them to handler via shared memory """
+
+    def __init__(self, frame_bus, handler: Callable, on_stop: Callable = None,
+                 procs: int = 2, slots: int = 4, timeout: float = 1.0, metrics_interval: float = 1.0):
+        super().__init__(name='ProcFrameProcessor')
+        self._bus = frame_bus
+        self._n_slots: int = slots  # shared memory slots for each cam
+        self._timeout: float = timeout
+        self._slots: Dict[int, CamSlots] = {}  # cam_id -> current slots block
+        self._old_slots: List[CamSlots] = []  # blocks replaced after frame shape change
+        self.dropped: Dict[int, int] = {}  # cam_id -> frames dropped because all slots were busy
+        ctx = mp.get_context('fork')  # workers inherit camera list and config
+        resource_tracker.ensure_running()  # shared with workers, so shm is unlinked only by this process
+        self._done_queue = ctx.Queue()
+        self._in_queues = [ctx.Queue() for _ in range(procs)]
+        self._procs = [ctx.Process(target=_worker_main, name=f"_frame_proc_{i}",
+                                   args=(q, self._done_queue, handler, on_stop, metrics_interval))
+                       for i, q in enumerate(self._in_queues)]
+        for p in self._procs:
+            p.start()
+        logging.debug(f"{procs} frame processing workers started")
+
+    def run(self):
+        while not self._bus.closed:
+            frame = self._bus.get(self._timeout)
+            if frame is None:  # timeout or bus is closed
+                while self._collect_done(False):
+                    pass
+                continue
+            Metrics.observe('queue', frame.cam_name, time.time() - frame.queued_time)
+            self._dispatch(frame)
+            frame.release()
+        self._stop_workers()
+
+    def _dispatch(self, frame):
+        image: np.ndarray = frame.image
+        cam_slots = self._slots.get(frame.cam_id)
+        if cam_slots is None or cam_slots.slot_bytes < image.nbytes:
+            if cam_slots is not None:
+                self._old_slots.append(cam_slots)
+            cam_slots = self._slots[frame.cam_id] = CamSlots(self._n_slots, image.nbytes)
+        if not self._free_slot(cam_slots):
+            self.dropped[frame.cam_id] = self.dropped.get(frame.cam_id, 0) + 1
+            Metrics.count('dropped', frame.cam_name)
+            return
+        slot = cam_slots.free.pop()
+        np.copyto(cam_slots.view(slot, image.shape, image.dtype), image)
+        self._in_queues[frame.cam_id % len(self._in_queues)].put(
+            (frame.cam_id, frame.cam_name, cam_slots.shm.name, slot, cam_slots.slot_bytes,
+             image.shape, image.dtype.str, frame.time, frame.timestamp, frame.scale))
+
+    def _free_slot(self, cam_slots: CamSlots) -> bool:
+        """ collect done queue messages (no waiting), True if cam has free slot """
+        while self._collect_done(False):
+            pass
+        return bool(cam_slots.free)
+
+    def _collect_done(self, block: bool) -> bool:
+        """ handle one done queue message (released slot or worker metrics), False if there was none """
+        try:
+            key, value = self._done_queue.get(block, self._timeout)
+        except queue.Empty:
+            return False
+        if key == _METRICS_MSG:
+            Metrics.merge(value)
+            return True
+        for cs in self._slots.values():
+            if cs.shm.name == key:
+                cs.free.append(value)
+                break
+        return True
+
+    def _stop_workers(self):
+        for q in self._in_queues:
+            q.put(None)
+        for p in self._procs:
+            while p.is_alive():  # keep done queue drained: worker can't exit with unsent messages
+                self._collect_done(False)
+                p.join(0.1)
+        while self._collect_done(False):  # the last metrics
+            pass
+        for cs in list(self._slots.values()) + self._old_slots:
+            cs.close()
+        logging.debug(f"frame processing workers stopped, dropped frames: {self.dropped}")
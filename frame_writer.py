@@ -0,0 +1,172 @@
+""" frame_writer.py - write cam frames to video files
+
+Encoding runs in a separate thread for each cam, so slow disk or encoder doesn't block frames processing.
+Video is written in time-based segments, every frame is recorded in cam index file (see video_index.py).
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict
+
+import cv2
+
+from config import cfg
+from metrics import Metrics
+from video_index import VideoIndexWriter
+
+
+class CamEncoder(threading.Thread):
+    """ encoder thread for one cam: takes frames from own bounded queue and writes them in batches
+
+    segment videofile is being created when its first frame is arrived (to avoid manual configuring of shape info),
+    new segment is started every write_segment_minutes
+    """
+
+    def __init__(self, cam_id: int, cam_name: str):
+        super().__init__(name="_encoder_" + cam_name)
+        self.cam_id: int = cam_id
+        self.cam_name: str = cam_name
+        self._queue = queue.Queue(cfg['write_frames_queue_size'])
+        self._batch_size: int = cfg['write_frames_batch']
+        self._handle: cv2.VideoWriter = None
+        self._segment_start: float = 0.0  # time of first frame in current segment
+        self._shape: tuple = None  # (height, width) of frames in current segment
+        self._index: VideoIndexWriter = None
+        self._stop_event = threading.Event()
+        self.written: int = 0
+        self.dropped: int = 0  # frames dropped because queue was full (or encoder is stopped)
+        self.errors: int = 0  # batches failed to write
+        self.encode_time: float = 0.0  # total encoding time of written frames (sec)
+
+    def __str__(self):
+        return f"CamEncoder({self.cam_name},{self.metrics()})"
+
+    def metrics(self) -> Dict:
+        return {'written': self.written, 'dropped': self.dropped, 'errors': self.errors, 'queue': self._queue.qsize(),
+                'encode_ms': round(1000 * self.encode_time / self.written, 2) if self.written else 0.0}
+
+    def put(self, frame) -> bool:
+        """ queue frame for writing (frame is retained till written), return False if frame is dropped """
+        try:
+            if self._stop_event.is_set():
+                raise queue.Full
+            self._queue.put_nowait(frame.retain())
+        except queue.Full:
+            frame.release()
+            self.dropped += 1
+            Metrics.count('write_dropped', self.cam_name)
+            return False
+        return True
+
+    def stop(self):
+        """ write queued frames, close file and finish thread (doesn't wait: queue may be full) """
+        self._stop_event.set()
+        try:
+            self._queue.put_nowait(None)  # wake up; if queue is full, run() sees stop flag when it's drained
+        except queue.Full:
+            pass
+
+    def run(self):
+        stopped = False
+        while not stopped:
+            try:
+                batch = [self._queue.get(timeout=cfg['frame_bus_timeout'])]
+            except queue.Empty:
+                stopped = self._stop_event.is_set()
+                continue
+            while len(batch) < self._batch_size:  # take what is already queued, up to batch size
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopped = True
+                batch.remove(None)
+            try:
+                self._write_batch(batch)
+            except Exception:
+                self.errors += 1
+                Metrics.count('write_errors', self.cam_name)
+                logging.exception(f"{self.cam_name}: {len(batch)} frames are not written")
+        if self._handle is not None:
+            self._handle.release()
+            logging.debug(f'File for {self.cam_name} is closed')
+        if self._index is not None:
+            self._index.close()
+
+    def _write_batch(self, batch):
+        """ write frames and release them (all of them, also if writing fails) """
+        start = time.perf_counter()
+        try:
+            for frame in batch:
+                frame_start = time.perf_counter()
+                if self._handle is None or frame.time - self._segment_start >= cfg['write_segment_minutes'] * 60 \
+                        or frame.image.shape[:2] != self._shape:  # e.g. frames are downscaled by load shedding
+                    self._start_segment(frame)
+                self._handle.write(frame.image)
+                self._index.add(frame.time)
+                self.written += 1
+                Metrics.observe('write', self.cam_name, time.perf_counter() - frame_start)
+            if self._index is not None:
+                self._index.flush()
+        finally:
+            for frame in batch:
+                frame.release()
+            self.encode_time += time.perf_counter() - start
+
+    def _start_segment(self, frame):
+        if self._handle is not None:
+            self._handle.release()
+        if self._index is None:
+            os.makedirs(cfg['write_frames_folder'], exist_ok=True)
+            self._index = VideoIndexWriter(cfg['write_frames_folder'], self.cam_name)
+        self._handle = self._create_video_file(frame, self._index.next_segment())
+        self._segment_start = frame.time
+        self._shape = frame.image.shape[:2]
+
+    def _create_video_file(self, frame, file_name: str) -> cv2.VideoWriter:
+        shape = (frame.image.shape[1], frame.image.shape[0])
+        fh = cv2.VideoWriter(file_name, cfg['write_frames_four_cc'], cfg['write_frames_fps'], shape)
+        logging.debug(f"Video file {file_name} created: shape={shape}, fps={cfg['write_frames_fps']}")
+        return fh
+
+
+class FrameWriter:
+    """ Write frames to videofiles (one encoder thread per cam) """
+    _encoders: Dict[int, CamEncoder] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def write_frame(cls, frame) -> bool:
+        """ queue frame for writing, return False if frame is dropped (encoder is too slow) """
+        try:
+            encoder = cls._encoders[frame.cam_id]
+        except KeyError:
+            with cls._lock:
+                encoder = cls._encoders.get(frame.cam_id)
+                if encoder is None:
+                    encoder = cls._encoders[frame.cam_id] = CamEncoder(frame.cam_id, frame.cam_name)
+                    encoder.start()
+        return encoder.put(frame)
+
+    @classmethod
+    def metrics(cls) -> Dict[str, Dict]:
+        """ cam_name -> {written, dropped, errors, queue, encode_ms} """
+        return {enc.cam_name: enc.metrics() for enc in list(cls._encoders.values())}
+
+    @classmethod
+    def close_all(cls):
+        """ write queued frames and close all opened video files """
+        with cls._lock:
+            encoders = list(cls._encoders.values())
+            cls._encoders.clear()
+        for encoder in encoders:
+            encoder.stop()
+        for encoder in encoders:
+            encoder.join(cfg['write_frames_stop_timeout'])
+            if encoder.is_alive():
+                logging.warning(f"{encoder.name} didn't stop")
+            logging.info(f"{encoder}")
@@ -0,0 +1,100 @@
+""" load_shedder.py - graceful degradation of frame processing under overload
+
+LoadShedder checks frame bus fill and p95 grab-to-processed latency every shed_check_interval sec
+(in 'process' processing mode latency comes from workers with up to processing_metrics_interval delay).
+After shed_raise_after overloaded checks in a row it goes one level up, after shed_restore_after calm
+checks in a row one level down (hysteresis: overloaded/calm thresholds differ). Level N sheds the first
+N actions of shed_levels:
+    display       - frames are not shown
+    low_priority  - cams with priority below shed_priority_below are captured at shed_low_priority_fps
+    downscale     - frames are downscaled by shed_downscale before they are queued for processing
+                    (frame.scale; detections are scaled back to cam frame size, so tracks are kept)
+    detection     - person detection is paused (tracks are predicted)
+Shed actions are kept in shared memory, so forked frame processing workers see them too.
+"""
+
+import logging
+import multiprocessing
+import threading
+from typing import Callable, Dict, List
+
+from config import cfg
+from camera import Camera
+from metrics import BUCKETS, Metrics, bucket_percentile
+
+DISPLAY, LOW_PRIORITY, DOWNSCALE, DETECTION = 'display', 'low_priority', 'downscale', 'detection'
+_BITS: Dict[str, int] = {DISPLAY: 1, LOW_PRIORITY: 2, DOWNSCALE: 4, DETECTION: 8}
+_shed_mask = multiprocessing.RawValue('i', 0)  # bits of shed actions (created before workers are forked)
+
+
+def is_shed(action: str) -> bool:
+    return bool(_shed_mask.value & _BITS[action])
+
+
+class LoadShedder(threading.Thread):
+
+    def __init__(self, cams: List[Camera], queue_fill: Callable[[], float]):
+        super().__init__(name='LoadShedder', daemon=True)
+        self.cams: List[Camera] = cams
+        self._queue_fill: Callable[[], float] = queue_fill  # 0..1
+        self.levels: List[str] = list(cfg['shed_levels'])
+        self.level: int = 0
+        self._overloaded: int = 0  # overloaded checks in a row
+        self._calm: int = 0  # calm checks in a row
+        self._latency_counts: List[int] = [0] * (len(BUCKETS) + 1)  # latency histogram at previous check
+        self._target_fps: Dict[int, float] = {}  # cam_id -> target_fps before throttling
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(cfg['shed_check_interval']):
+            self.check()
+
+    def stop(self):
+        self._stop_event.set()
+        self._set_level(0)
+
+    def _latency_p95(self) -> float:
+        """ p95 grab-to-processed latency of frames processed since previous check """
+        counts = Metrics.stage_histogram('latency').counts
+        delta = [c - p for c, p in zip(counts, self._latency_counts)]
+        self._latency_counts = counts
+        return bucket_percentile(delta, 0.95)
+
+    def check(self):
+        fill, latency = self._queue_fill(), self._latency_p95()
+        if fill >= cfg['shed_queue_high'] or latency >= cfg['shed_latency_high']:
+            self._overloaded, self._calm = self._overloaded + 1, 0
+        elif fill <= cfg['shed_queue_low'] and latency <= cfg['shed_latency_low']:
+            self._overloaded, self._calm = 0, self._calm + 1
+        else:
+            self._overloaded = self._calm = 0
+        if self._overloaded >= cfg['shed_raise_after'] and self.level < len(self.levels):
+            self._set_level(self.level + 1)
+            logging.warning(f"Overload (queue fill {fill:.2f}, latency p95 {latency:.3f}s): "
+                            f"shedding {self.levels[:self.level]}")
+        elif self._calm >= cfg['shed_restore_after'] and self.level > 0:
+            self._set_level(self.level - 1)
+            logging.info(f"Load dropped: shedding {self.levels[:self.level] or 'nothing'}")
+
+    def _set_level(self, level: int):
+        self.level = level
+        self._overloaded = self._calm = 0
+        active = self.levels[:level]
+        mask = 0
+        for action in active:
+            mask |= _BITS[action]
+        _shed_mask.value = mask
+        self._throttle(LOW_PRIORITY in active)
+        Metrics.count('shed_changes', 'all')
+
+    def _throttle(self, on: bool):
+        """ lower capture rate of low priority cams (on), restore it (off) """
+        if on:
+            for cam in self.cams:
+                if cam.priority < cfg['shed_priority_below'] and cam.cam_id not in self._target_fps:
+                    self._target_fps[cam.cam_id] = cam.target_fps
+                    cam.target_fps = min(cam.target_fps or cfg['shed_low_priority_fps'], cfg['shed_low_priority_fps'])
+        else:
+            for cam in self.cams:
+                if cam.cam_id in self._target_fps:
+                    cam.target_fps = self._target_fps.pop(cam.cam_id)
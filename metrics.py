@@ -0,0 +1,256 @@
+""" metrics.py - per-cam, per-stage latency histograms and counters
+
+Stages: capture (grab+decode), decode, queue (wait in frame bus), process (all frame handlers), write (encoding),
+display, latency (grab --> processed). Histograms have fixed log-scale buckets, so observe() is one bisect and a few additions.
+Metrics are logged periodically (MetricsReporter) and served as Prometheus text (MetricsServer, GET /metrics).
+In 'process' processing mode worker processes send their metrics and gauges to the main process (Metrics.delta/merge).
+"""
+
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple
+
+BUCKETS: List[float] = [0.0005 * 2 ** i for i in range(16)]  # upper bounds (sec): 0.5ms .. 16s, then +Inf
+
+
+class Histogram:
+    """ latency histogram with fixed BUCKETS """
+
+    def __init__(self):
+        self.counts: List[int] = [0] * (len(BUCKETS) + 1)
+        self.total: int = 0
+        self.sum: float = 0.0
+        self.max: float = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(BUCKETS, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.total += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, q: float) -> float:
+        """ upper bound of the bucket holding q-th (0..1) value (max value for the last bucket) """
+        with self._lock:
+            counts, max_value = list(self.counts), self.max
+        return bucket_percentile(counts, q, max_value)
+
+
+def bucket_percentile(counts: List[int], q: float, max_value: float = float('inf')) -> float:
+    """ q-th (0..1) percentile of values counted in BUCKETS (+Inf) """
+    total = sum(counts)
+    if not total:
+        return 0.0
+    rank, acc = q * total, 0
+    for i, cnt in enumerate(counts):
+        acc += cnt
+        if acc >= rank:
+            return min(BUCKETS[i], max_value) if i < len(BUCKETS) else max_value
+    return max_value
+
+
+class Metrics:
+    """ metrics registry: (stage, cam_name) histograms, (name, cam_name) counters and gauge collectors """
+    _hists: Dict[Tuple[str, str], Histogram] = {}
+    _counters: Dict[Tuple[str, str], int] = {}
+    _lock = threading.Lock()
+    _start: float = time.time()
+    _sent: Dict = {}  # key -> values already passed by delta() (worker process side)
+    _remote_gauges: Dict[str, float] = {}  # last gauges of worker processes (main process side, by merge())
+    collectors: List[Callable[[], Dict[str, float]]] = []  # gauges: name (or name{labels}) -> value, on report
+
+    @classmethod
+    def observe(cls, stage: str, cam_name: str, seconds: float):
+        cls._histogram(stage, cam_name).observe(seconds)
+
+    @classmethod
+    def _histogram(cls, stage: str, cam_name: str) -> Histogram:
+        key = (stage, cam_name)
+        hist = cls._hists.get(key)
+        if hist is None:
+            with cls._lock:
+                hist = cls._hists.setdefault(key, Histogram())
+        return hist
+
+    @classmethod
+    def count(cls, name: str, cam_name: str, n: int = 1):
+        key = (name, cam_name)
+        with cls._lock:
+            cls._counters[key] = cls._counters.get(key, 0) + n
+
+    @classmethod
+    def histogram(cls, stage: str, cam_name: str) -> Histogram:
+        """ histogram of (stage, cam), None if nothing was observed yet """
+        return cls._hists.get((stage, cam_name))
+
+    @classmethod
+    def stage_histogram(cls, stage: str) -> Histogram:
+        """ histogram of stage merged over all cams """
+        merged = Histogram()
+        for (st, _), h in list(cls._hists.items()):
+            if st == stage:
+                with h._lock:
+                    merged.counts = [a + b for a, b in zip(merged.counts, h.counts)]
+                    merged.total += h.total
+                    merged.sum += h.sum
+                    merged.max = max(merged.max, h.max)
+        return merged
+
+    @classmethod
+    def counter(cls, name: str, cam_name: str) -> int:
+        return cls._counters.get((name, cam_name), 0)
+
+    @classmethod
+    def gauges(cls) -> Dict[str, float]:
+        result = dict(cls._remote_gauges)
+        for collector in cls.collectors:
+            try:
+                result.update(collector())
+            except Exception:
+                logging.exception("Metrics collector failed")
+        return result
+
+    @classmethod
+    def summary(cls) -> str:
+        """ one line per (stage, cam): count, rate, mean, p50/p95/p99, max; then counters and gauges """
+        elapsed = max(time.time() - cls._start, 1e-9)
+        lines = []
+        for (stage, cam_name), h in sorted(cls._hists.items()):
+            if not h.total:
+                continue
+            lines.append(f"{stage:8s} {cam_name:12s} n={h.total} {h.total / elapsed:.1f}/s "
+                         f"mean={1000 * h.sum / h.total:.1f}ms p50={1000 * h.percentile(0.5):.1f}ms "
+                         f"p95={1000 * h.percentile(0.95):.1f}ms p99={1000 * h.percentile(0.99):.1f}ms "
+                         f"max={1000 * h.max:.1f}ms")
+        with cls._lock:
+            counters = sorted(cls._counters.items())
+        lines += [f"{name} {cam_name}={value}" for (name, cam_name), value in counters]
+        lines += [f"{name}={value}" for name, value in sorted(cls.gauges().items())]
+        return '\n'.join(lines)
+
+    @classmethod
+    def prometheus_text(cls) -> str:
+        out = ['# TYPE vint_stage_seconds histogram']
+        for (stage, cam_name), h in sorted(cls._hists.items()):
+            labels = f'stage="{stage}",cam="{cam_name}"'
+            acc = 0
+            for bound, cnt in zip(BUCKETS + [float('inf')], list(h.counts)):
+                acc += cnt
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                out.append(f'vint_stage_seconds_bucket{{{labels},le="{le}"}} {acc}')
+            out.append(f'vint_stage_seconds_sum{{{labels}}} {h.sum}')
+            out.append(f'vint_stage_seconds_count{{{labels}}} {acc}')
+        with cls._lock:
+            counters = sorted(cls._counters.items())
+        for name in sorted({name for (name, _), _ in counters}):
+            out.append(f'# TYPE vint_{name}_total counter')
+            out += [f'vint_{name}_total{{cam="{cam_name}"}} {value}' for (n, cam_name), value in counters if n == name]
+        typed = set()
+        for name, value in sorted(cls.gauges().items()):
+            base = name.split('{')[0]  # gauge name may have labels: name{cam="..."}
+            if base not in typed:
+                typed.add(base)
+                out.append(f'# TYPE vint_{base} gauge')
+            out.append(f'vint_{name} {value}')
+        return '\n'.join(out) + '\n'
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._hists.clear()
+            cls._counters.clear()
+            cls._sent.clear()
+            cls._remote_gauges.clear()
+            cls._start = time.time()
+
+    @classmethod
+    def delta(cls) -> Dict:
+        """ histograms and counters changed since previous delta() and current gauges of this process
+        (picklable, for merge() in other process) """
+        result = {'hists': {}, 'counters': {}, 'gauges': cls.gauges()}
+        for key, h in list(cls._hists.items()):
+            with h._lock:
+                counts, total, total_sum, max_value = list(h.counts), h.total, h.sum, h.max
+            sent_counts, sent_total, sent_sum = cls._sent.get(('h',) + key, ([0] * len(counts), 0, 0.0))
+            if total == sent_total:
+                continue
+            result['hists'][key] = ([a - b for a, b in zip(counts, sent_counts)], total - sent_total,
+                                    total_sum - sent_sum, max_value)
+            cls._sent[('h',) + key] = (counts, total, total_sum)
+        with cls._lock:
+            counters = list(cls._counters.items())
+        for key, value in counters:
+            sent = cls._sent.get(('c',) + key, 0)
+            if value != sent:
+                result['counters'][key] = value - sent
+                cls._sent[('c',) + key] = value
+        return result
+
+    @classmethod
+    def merge(cls, delta: Dict):
+        """ add delta() of other process """
+        for (stage, cam_name), (counts, total, total_sum, max_value) in delta['hists'].items():
+            h = cls._histogram(stage, cam_name)
+            with h._lock:
+                h.counts = [a + b for a, b in zip(h.counts, counts)]
+                h.total += total
+                h.sum += total_sum
+                h.max = max(h.max, max_value)
+        for (name, cam_name), n in delta['counters'].items():
+            cls.count(name, cam_name, n)
+        cls._remote_gauges.update(delta['gauges'])
+
+
+class MetricsReporter(threading.Thread):
+    """ log Metrics.summary() every interval sec """
+
+    def __init__(self, interval: float):
+        super().__init__(name='MetricsReporter', daemon=True)
+        self.interval: float = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            logging.info(f"Metrics:\n{Metrics.summary()}")
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = Metrics.prometheus_text().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # no per-request logging
+        pass
+
+
+class MetricsServer(threading.Thread):
+    """ local http endpoint with Prometheus text format metrics """
+
+    def __init__(self, host: str, port: int):
+        super().__init__(name='MetricsServer', daemon=True)
+        self._server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self.port: int = self._server.server_address[1]
+
+    def run(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,82 @@
+""" motion.py - cheap motion pre-filter: decides whether frame goes to Detector at all
+
+Downscaled grayscale frame is compared with running-average background of its cam (inside cam ROI),
+frame has motion if changed part of ROI >= cam motion sensitivity.
+"""
+
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+from config import cfg
+from camera import Camera
+
+
+class MotionGate:
+    """ motion detection state of one cam """
+    _gates: Dict[int, "MotionGate"] = {}
+
+    def __init__(self, cam: Camera):
+        self.cam: Camera = cam
+        self.sensitivity: float = cam.motion_sensitivity  # changed part of ROI to pass frame, 0 - pass all
+        self._background: np.ndarray = None  # float32 running average of small gray frames
+        self._mask: np.ndarray = None  # ROI mask in small frame coordinates
+        self._mask_area: int = 0
+        self._last_motion: float = 0.0  # time of last frame with motion
+        self.passed: int = 0
+        self.skipped: int = 0
+
+    def __str__(self):
+        return f"MotionGate({self.cam.cam_name},passed={self.passed},skipped={self.skipped})"
+
+    @classmethod
+    def check(cls, frame) -> bool:
+        """ True if frame has to be passed to detector """
+        gate = cls._gates.get(frame.cam_id)
+        if gate is None:
+            gate = cls._gates[frame.cam_id] = MotionGate(Camera.cam_list[frame.cam_id])
+        passed = gate.has_motion(frame.image, frame.time, frame.scale)
+        if passed:
+            gate.passed += 1
+        else:
+            gate.skipped += 1
+        return passed
+
+    def has_motion(self, image: np.ndarray, frame_time: float, scale: float = 1.0) -> bool:
+        """ scale: image size / cam frame size (ROI is in cam frame coordinates) """
+        if not self.sensitivity:
+            return True
+        gray = self._small_gray(image)
+        if self._background is None:
+            self._background = gray.astype(np.float32)
+            self._mask = self._roi_mask((image.shape[0] / scale, image.shape[1] / scale), gray.shape, self.cam.roi)
+            self._mask_area = cv2.countNonZero(self._mask)
+            self._last_motion = frame_time
+            return True
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self._background))
+        _, changed = cv2.threshold(diff, cfg['motion_pixel_threshold'], 255, cv2.THRESH_BINARY)
+        changed_part = cv2.countNonZero(cv2.bitwise_and(changed, self._mask)) / max(1, self._mask_area)
+        cv2.accumulateWeighted(gray, self._background, cfg['motion_learning_rate'])
+        if changed_part >= self.sensitivity:
+            self._last_motion = frame_time
+        return frame_time - self._last_motion <= cfg['motion_hold']  # keep detecting a while after motion stops
+
+    @staticmethod
+    def _small_gray(image: np.ndarray) -> np.ndarray:
+        h, w = image.shape[:2]
+        width = cfg['motion_width']
+        small = cv2.resize(image, (width, max(1, h * width // w)), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    @staticmethod
+    def _roi_mask(image_shape: Tuple, small_shape: Tuple, roi: List[Tuple[int, int]]) -> np.ndarray:
+        """ ROI polygon (in image coordinates) as mask of small frame; whole frame if ROI is not set """
+        if not roi:
+            return np.full(small_shape, 255, np.uint8)
+        mask = np.zeros(small_shape, np.uint8)
+        scale = small_shape[1] / image_shape[1]
+        points = np.array([(x * scale, y * scale) for x, y in roi], np.int32)
+        cv2.fillPoly(mask, [points], 255)
+        return mask
@@ -0,0 +1,91 @@
+""" passthrough.py - record cam compressed stream as is (no decode / re-encode)
+
+ffmpeg remuxes original H.264/H.265 packets into time-based segment files <cam_name>_<start time><suffix>,
+so recording costs near-zero CPU. ffmpeg is restarted if the stream breaks.
+"""
+
+import logging
+import os
+import signal
+import subprocess
+import threading
+from typing import List
+
+from config import cfg
+from camera import Camera
+
+
+class PassthroughRecorder(threading.Thread):
+    """ supervise ffmpeg process that copies one cam stream to segment files """
+    _recorders: List["PassthroughRecorder"] = []
+
+    def __init__(self, cam: Camera):
+        super().__init__(name="_recorder_" + cam.cam_name, daemon=True)
+        self.cam: Camera = cam
+        self._proc: subprocess.Popen = None
+        self._stop_event = threading.Event()
+        self._proc_lock = threading.Lock()  # stop() either prevents next ffmpeg start or sees started process
+        self.restarts: int = 0
+
+    def _command(self) -> List[str]:
+        folder = cfg['write_frames_folder']
+        cmd = [cfg['passthrough_ffmpeg'], '-nostdin', '-loglevel', 'error']
+        if self.cam.access_str.startswith('rtsp'):
+            cmd += ['-rtsp_transport', self.cam.transport or 'tcp']
+        cmd += ['-i', self.cam.access_str, '-map', '0:v', '-c', 'copy',
+                '-f', 'segment', '-segment_time', str(int(cfg['write_segment_minutes'] * 60)),
+                '-reset_timestamps', '1', '-strftime', '1',
+                f"{folder}{self.cam.cam_name}_%y%m%d_%H%M%S{cfg['passthrough_suffix']}"]
+        return cmd
+
+    def run(self):
+        os.makedirs(cfg['write_frames_folder'], exist_ok=True)
+        while True:
+            with self._proc_lock:
+                if self._stop_event.is_set():
+                    break
+                self._proc = subprocess.Popen(self._command(), stdin=subprocess.DEVNULL)
+            logging.debug(f"Passthrough recording of {self.cam} started")
+            ret = self._proc.wait()
+            if self._stop_event.is_set():
+                break
+            logging.warning(f"Passthrough recording of {self.cam} exited with {ret}, restarting")
+            self.restarts += 1
+            self._stop_event.wait(cfg['passthrough_restart_delay'])
+        logging.debug(f"Passthrough recording of {self.cam} stopped")
+
+    def stop(self):
+        """ let ffmpeg finalize current segment and exit """
+        with self._proc_lock:
+            self._stop_event.set()
+            proc = self._proc
+        if proc is not None and proc.poll() is None:
+            proc.send_signal(signal.SIGINT)
+            try:
+                proc.wait(cfg['passthrough_stop_timeout'])
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    @classmethod
+    def start_all(cls, cams: List[Camera]):
+        for cam in cams:
+            recorder = PassthroughRecorder(cam)
+            cls._recorders.append(recorder)
+            recorder.start()
+
+    @classmethod
+    def stop_cam(cls, cam: Camera):
+        for recorder in [r for r in cls._recorders if r.cam is cam]:
+            recorder.stop()
+            recorder.join(cfg['passthrough_stop_timeout'])
+            cls._recorders.remove(recorder)
+
+    @classmethod
+    def stop_all(cls):
+        for recorder in cls._recorders:
+            recorder.stop()
+        for recorder in cls._recorders:
+            recorder.join(cfg['passthrough_stop_timeout'])
+            if recorder.is_alive():
+                logging.warning(f"{recorder.name} didn't stop")
+        cls._recorders.clear()
@@ -0,0 +1,136 @@
+""" frame_archive.py - local append-only frame store (instead of LONGBLOB row per frame in MySQL)
+
+Images are appended to segment files (raw bytes or JPEG/PNG/lz4 compressed),
+SQLite index keeps cam_id/timestamp/shape/dtype and position of each frame.
+Raw frames are read zero-copy: np.frombuffer over memory-mapped segment. Mapping of grown segment is replaced by
+new one; the old mapping is unmapped when the last view into it is gone.
+"""
+
+import mmap
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+CODECS = ('raw', 'jpeg', 'png', 'lz4')
+
+
+class FrameArchive:
+    """ frames of all cams in segment files of folder, indexed by (cam_id, ts) in folder/index.sqlite """
+
+    def __init__(self, folder: str, codec: str = 'raw', segment_bytes: int = 1 << 30, jpeg_quality: int = 90):
+        if codec not in CODECS:
+            raise ValueError(f"unknown codec {codec}, expected one of {CODECS}")
+        if codec == 'lz4' and lz4_frame is None:
+            raise ValueError("lz4 codec requires lz4 package")
+        self.folder: str = folder
+        self.codec: str = codec
+        self.segment_bytes: int = segment_bytes  # new segment file is started when current one is bigger
+        self.jpeg_quality: int = jpeg_quality
+        os.makedirs(folder, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(folder, 'index.sqlite'), check_same_thread=False)
+        self.db.execute('create table if not exists frames '
+                        '    (id integer primary key, cam_id int, ts real, segment int, offset int, length int, '
+                        '     codec text, h int, w int, c int, dtype text)')
+        self.db.execute('create index if not exists frames_cam_ts on frames (cam_id, ts)')
+        row = self.db.execute('select max(segment) from frames').fetchone()
+        self.segment: int = row[0] or 0
+        self._maps: Dict[int, mmap.mmap] = {}  # segment -> latest read-only mapping
+        self._lock = threading.Lock()  # one writer at a time (frame ids are assigned sequentially)
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """ close index and mappings; mappings with views still alive are unmapped when the views are gone """
+        for mm in getattr(self, '_maps', {}).values():
+            try:
+                mm.close()
+            except BufferError:  # raw frames loaded from it are still in use
+                pass
+        getattr(self, '_maps', {}).clear()
+        if getattr(self, 'db', None) is not None:
+            self.db.close()
+            self.db = None
+
+    def _segment_file(self, segment: int) -> str:
+        return os.path.join(self.folder, f'seg_{segment:06d}.bin')
+
+    def _encode(self, img: np.ndarray) -> bytes:
+        if self.codec == 'jpeg':
+            return cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])[1].tobytes()
+        if self.codec == 'png':
+            return cv2.imencode('.png', img)[1].tobytes()
+        data = np.ascontiguousarray(img).reshape(-1).view(np.uint8).data  # flat bytes, no copy
+        return lz4_frame.compress(data) if self.codec == 'lz4' else data
+
+    def append(self, cam_id: int, ts: float, img: np.ndarray) -> int:
+        return self.append_batch([(cam_id, ts, img)])[0]
+
+    def append_batch(self, frames: List[Tuple[int, float, np.ndarray]]) -> List[int]:
+        """ append (cam_id, ts, image) frames: sequential write to segment + one index transaction """
+        with self._lock:
+            return self._append_batch(frames)
+
+    def _append_batch(self, frames: List[Tuple[int, float, np.ndarray]]) -> List[int]:
+        seg_file = self._segment_file(self.segment)
+        offset = os.path.getsize(seg_file) if os.path.exists(seg_file) else 0
+        if offset >= self.segment_bytes:
+            self.segment, offset = self.segment + 1, 0
+        rows = []
+        with open(self._segment_file(self.segment), 'ab') as f:
+            for cam_id, ts, img in frames:
+                data = self._encode(img)
+                f.write(data)
+                h, w = img.shape[:2]
+                c = img.shape[2] if img.ndim == 3 else 1
+                rows.append((cam_id, ts, self.segment, offset, len(data), self.codec, h, w, c, img.dtype.str))
+                offset += len(data)
+        with self.db:
+            first_id = self.db.execute('select coalesce(max(id), 0) + 1 from frames').fetchone()[0]
+            self.db.executemany('insert into frames (cam_id, ts, segment, offset, length, codec, h, w, c, dtype) '
+                                'values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        return list(range(first_id, first_id + len(rows)))
+
+    def _map(self, segment: int, end: int) -> mmap.mmap:
+        """ mapping of segment covering [0, end); old mapping is not closed: views loaded from it may be alive """
+        mm = self._maps.get(segment)
+        if mm is None or len(mm) < end:  # not mapped yet or segment has grown
+            with open(self._segment_file(segment), 'rb') as f:
+                mm = self._maps[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return mm
+
+    def load(self, frame_id: int) -> np.ndarray:
+        """ image by id; raw frames are read-only views of the archive (no copy) """
+        row = self.db.execute('select segment, offset, length, codec, h, w, c, dtype from frames where id=?',
+                              (frame_id,)).fetchone()
+        if row is None:
+            raise KeyError(frame_id)
+        segment, offset, length, codec, h, w, c, dtype = row
+        buf = np.frombuffer(self._map(segment, offset + length), np.uint8, length, offset)
+        shape = (h, w, c) if c > 1 else (h, w)
+        if codec == 'raw':
+            return buf.view(dtype).reshape(shape)
+        if codec == 'lz4':
+            return np.frombuffer(lz4_frame.decompress(buf), dtype).reshape(shape)
+        return cv2.imdecode(buf, cv2.IMREAD_UNCHANGED)
+
+    def find(self, cam_id: int, ts_from: float, ts_to: float) -> List[Tuple[int, float]]:
+        """ (id, ts) of cam frames with ts_from <= ts < ts_to """
+        return self.db.execute('select id, ts from frames where cam_id=? and ts>=? and ts<? order by ts',
+                               (cam_id, ts_from, ts_to)).fetchall()
+
+
+if __name__ == '__main__':
+    archive = FrameArchive('/tmp/frame_archive', codec='raw')
+    img = np.random.randint(0, 255, (720, 1280, 3), np.uint8)
+    ids = archive.append_batch([(1, float(i), img) for i in range(10)])
+    print(ids, archive.find(1, 2.0, 5.0), np.array_equal(archive.load(ids[3]), img))
@@ -1,44 +1,124 @@
 
 
-import cv2
-import numpy as np
 import json
-import mysql.connector
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    from mysql.connector import pooling
+except ImportError:  # sqlite backend only
+    pooling = None
+
+
+class _SqlitePool:
+    """ minimal connection pool for sqlite backend (same interface as MySQLConnectionPool) """
+
+    def __init__(self, database, pool_size):
+        self._free = queue.Queue()
+        for _ in range(pool_size):
+            self._free.put(sqlite3.connect(database, check_same_thread=False, timeout=30))
+
+    def get_connection(self):
+        return _SqliteConnection(self, self._free.get())
+
+    def close_all(self):
+        while not self._free.empty():
+            self._free.get().close()
+
+
+class _SqliteConnection:
+    """ pooled sqlite connection: close() returns it to the pool """
+
+    def __init__(self, pool, conn):
+        self._pool, self._conn = pool, conn
+
+    def cursor(self):
+        return self._conn.cursor()
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._pool._free.put(self._conn)
+
 
 class MyDb:
+    """ statements use %s placeholders for both backends; only table names are put into sql text """
 
-    def __init__(self,db_param = {'host':'localhost','user':'root', 'passwd':'121212', 'database':'mysql'}):
+    def __init__(self,db_param = {'host':'localhost','user':'root', 'passwd':'121212', 'database':'mysql'},
+                 backend='mysql', pool_size=4):
         self.db_param=db_param
-        self.mydb=mysql.connector.connect(
-            host=db_param['host'],user=db_param['user'],passwd=db_param['passwd'],database=db_param['database']
-            ,autocommit=True
-            ,charset='latin1'
-            # ,use_unicode=True
-            #,buffered=True
-            )
-        self.curs = self.mydb.cursor()
-        print(f"connected to {db_param['user']}:{db_param['database']} host={db_param['host']}")
+        self.backend=backend
+        if backend == 'sqlite':
+            self._pool = _SqlitePool(db_param['database'], pool_size)
+        else:
+            self._pool = pooling.MySQLConnectionPool(
+                pool_name=f"my_db_{id(self)}", pool_size=pool_size,
+                host=db_param['host'],user=db_param['user'],passwd=db_param['passwd'],database=db_param['database']
+                ,autocommit=False
+                )
+        self._writer = None
+        logging.info(f"connected to {db_param.get('user','')}:{db_param['database']} "
+                     f"host={db_param.get('host','')} backend={backend}")
 
     def __del__(self):
-        # self.curs.close()
-        self.mydb.close()
+        self.close()
 
-    def exec(self,statement,args=None):
-        print(f"\nExec:{statement}:\n")
+    def close(self):
+        if getattr(self, '_writer', None) is not None:
+            self._writer.close()
+            self._writer = None
+        if self.backend == 'sqlite' and getattr(self, '_pool', None) is not None:
+            self._pool.close_all()
+            self._pool = None
+
+    def _sql(self, statement):
+        return statement.replace('%s', '?') if self.backend == 'sqlite' else statement
+
+    @contextmanager
+    def transaction(self):
+        """ cursor of pooled connection; commit on exit, rollback on error """
+        conn = self._pool.get_connection()
+        curs = conn.cursor()
         try:
-            self.curs.execute(statement,args)
-        except  mysql.connector.Error as err:
-            print(f"Something went wrong while exec {statement}: {format(err)}")
+            yield curs
+            conn.commit()
+        except Exception:
+            conn.rollback()
             raise
-        #if len(self.curs):
-        result_str = [s for s in self.curs]
-        for s in result_str:
-            print(s)
-        return result_str
+        finally:
+            curs.close()
+            conn.close()
+
+    def exec(self,statement,args=None):
+        if logging.getLogger().isEnabledFor(logging.DEBUG):  # args may hold multi-MB blobs
+            logging.debug("Exec:%s:%s", statement, _loggable(args))
+        with self.transaction() as curs:
+            curs.execute(self._sql(statement), args or ())
+            return curs.fetchall() if curs.description else []
 
+    def exec_many(self,statement,rows):
+        """ one statement for many rows, in one transaction """
+        with self.transaction() as curs:
+            curs.executemany(self._sql(statement), rows)
+
+    def writer(self, flush_rows=500, flush_interval=1.0):
+        """ shared background batch writer of this db """
+        if self._writer is None:
+            self._writer = DbWriter(self, flush_rows, flush_interval)
+        return self._writer
 
     def get_fname_lst(self,fname_pattern,table_name='polygons'):
-        fname_tuple_lst = self.exec(f'select fname from {table_name} where fname like "{fname_pattern}"')
+        fname_tuple_lst = self.exec(f'select fname from {table_name} where fname like %s', (fname_pattern,))
         return [ fn[0] for fn in fname_tuple_lst]
 
     def save_points_to_db(self,img_fname,
@@ -48,19 +128,15 @@ class MyDb:
             f'create table if not exists {table_name} '
             f'    (fname varchar(80), points_lst varchar(80), left_angle int, right_angle int)'
             )
-        # self.exec(f'describe {table_name}')
-        if delete_old:
-            self.exec(f'delete from {table_name} where fname="{img_fname}"')
         json_points=json.dumps(points_list)
-        self.exec(
-            f'insert into {table_name} '
-            f'    values ( "{img_fname}", "{json_points}", {side_angles[0]}, {side_angles[1]} )')
+        with self.transaction() as curs:
+            if delete_old:
+                curs.execute(self._sql(f'delete from {table_name} where fname=%s'), (img_fname,))
+            curs.execute(self._sql(f'insert into {table_name} values (%s, %s, %s, %s)'),
+                         (img_fname, json_points, side_angles[0], side_angles[1]))
 
     def load_points_from_db(self,fname,table_name='polygons'):
-        result_str = self.exec(
-            f'select * from {table_name} '
-            f'    where fname="{fname}"'
-            )[0]
+        result_str = self.exec(f'select * from {table_name} where fname=%s', (fname,))[0]
         json_str = result_str[1]
         list_lists = json.loads(json_str)
         points_list = [ tuple(i) for i in list_lists ]
@@ -69,58 +145,135 @@ class MyDb:
     def save_matrix(self,fname,
                     matrix,width,height,
                     delete_old=True,table_name='transforms'):
-        if delete_old:
-            self.exec(f'delete from {table_name} where fname="{fname}"')
         json_mat=json.dumps(matrix.tolist())
-        self.exec(
-            f'insert into {table_name} '
-            f'    values ( "{fname}", "{json_mat}", {width}, {height} )')
+        with self.transaction() as curs:
+            if delete_old:
+                curs.execute(self._sql(f'delete from {table_name} where fname=%s'), (fname,))
+            curs.execute(self._sql(f'insert into {table_name} values (%s, %s, %s, %s)'),
+                         (fname, json_mat, width, height))
 
     def load_matrix(self,fname,table_name='transforms'):
-        result_str = self.exec(
-            f'select * from {table_name} '
-            f'    where fname="{fname}"'
-            )[0]
+        result_str = self.exec(f'select * from {table_name} where fname=%s', (fname,))[0]
         lst = json.loads(result_str[1])
         return np.array(lst),result_str[2],result_str[3]  # (points_lst,width,height)
 
     def save_combination(self,fname_trans,fname_pic,
                          trans_points_lst,trans_left_ang,trans_right_ang,
                          delete_old=True,table_name='combinations'):
-        if delete_old:
-            self.exec(
-                f'delete from {table_name} '
-                f'where fname_pic="{fname_pic}" and fname_trans="{fname_trans}"')
         json_lst=json.dumps(trans_points_lst.tolist())
-        self.exec(
-            f'insert into {table_name} '
-            f'    values ( "{fname_pic}", "{fname_trans}", "{json_lst}", '
-            f'              {trans_left_ang}, {trans_right_ang} )')
+        with self.transaction() as curs:
+            if delete_old:
+                curs.execute(self._sql(f'delete from {table_name} where fname_pic=%s and fname_trans=%s'),
+                             (fname_pic, fname_trans))
+            curs.execute(self._sql(f'insert into {table_name} values (%s, %s, %s, %s, %s)'),
+                         (fname_pic, fname_trans, json_lst, trans_left_ang, trans_right_ang))
 
     def save_img(self,img,id,table='frames'):
-        self.curs.execute(f'INSERT INTO {table} VALUES ({id}, %s)', (img.tobytes(),))
+        self.exec(f'INSERT INTO {table} VALUES (%s, %s)', (id, img.tobytes()))
 
     def load_img(self,id,dtype='uint8',shape=(720,1280,3),table='frames'):
-        self.curs.execute(f'select * from {table} where id={id}')
-        rest_s = self.curs.fetchall()[0][1]
-        rest_img = np.frombuffer(np.array(bytes(rest_s, encoding='latin1')), dtype=dtype).reshape(shape)
+        rest_s = self.exec(f'select * from {table} where id=%s', (id,))[0][1]
+        rest_img = np.frombuffer(bytes(rest_s), dtype=dtype).reshape(shape)
         return rest_img
 
 
-if __name__=='__main__':
-    img_fname = '/home/im/mypy/Homography/book.jpg'
-    img = cv2.imread(img_fname)
-    db=MyDb()
-    tbl_name = 'images'
-    # db.exec('select * from poly;')
-    #db.exec(f'create table if not exists {tbl_name} (file_id varchar(80), img blob);')
-    #db.exec('show tables;')
-    db.exec('insert into transforms values ("aa","bb",1,2)')
-
-    # db.exec(f'select * from {tbl_name};')
-    # db.save_img_to_db(img_fname,img,tbl_name)
-    # img2=db.load_img_from_db(img_fname)
-    # img_fname_splitted = img_fname.split(sep='.')
-    # new_fname = img_fname_splitted[-2]+"-loaded"+img_fname_splitted[-1]
-    # cv2.imwrite(new_fname,img2)
+def _loggable(args):
+    """ args for log: blobs replaced by their size """
+    if args is None:
+        return None
+    return tuple(f"<{len(a)} bytes>" if isinstance(a, (bytes, bytearray, memoryview)) else a for a in args)
+
+
+class DbWriter:
+    """ batched writes: add() only queues the row; rows are written by executemany in one transaction
+    when flush_rows are queued or every flush_interval sec (background thread), so callers never wait for db
 
+    rows of failed flush are put back before newer ones and retried by next flushes; after max_retries
+    failures in a row they are dropped (counted in dropped)
+    """
+
+    def __init__(self, db, flush_rows=500, flush_interval=1.0, max_retries=5):
+        self.db = db
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._failures = 0  # failed flushes in a row
+        self._pending = {}  # statement -> list of rows
+        self._pending_cnt = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # flushes don't overlap, so rows are written in order
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self.written = 0
+        self.dropped = 0
+        self.flush_time = 0.0
+        self._thread = threading.Thread(target=self._run, name='DbWriter', daemon=True)
+        self._thread.start()
+
+    def add(self, statement, row):
+        with self._lock:
+            self._pending.setdefault(statement, []).append(row)
+            self._pending_cnt += 1
+            full = self._pending_cnt >= self.flush_rows
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending, self._pending_cnt = self._pending, {}, 0
+            if not pending:
+                return
+            start = time.perf_counter()
+            try:
+                with self.db.transaction() as curs:
+                    for statement, rows in pending.items():
+                        curs.executemany(self.db._sql(statement), rows)
+            except Exception:
+                self._failed(pending)
+                raise
+            self._failures = 0
+            self.flush_time += time.perf_counter() - start
+            self.written += sum(len(rows) for rows in pending.values())
+
+    def _failed(self, pending):
+        """ put rows of failed flush back in front of rows added meanwhile (or drop them after max_retries) """
+        count = sum(len(rows) for rows in pending.values())
+        self._failures += 1
+        if self._failures > self.max_retries:
+            logging.error(f"DbWriter: {count} rows dropped after {self.max_retries} retries")
+            self.dropped += count
+            self._failures = 0
+            return
+        with self._lock:
+            merged = {statement: rows + self._pending.pop(statement, []) for statement, rows in pending.items()}
+            merged.update(self._pending)
+            self._pending, self._pending_cnt = merged, self._pending_cnt + count
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logging.exception("DbWriter flush failed")
+
+    def close(self):
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+
+
+if __name__=='__main__':
+    db=MyDb({'database': '/tmp/my_db.sqlite'}, backend='sqlite')
+    db.exec('create table if not exists events (cam_id int, track_id int, kind varchar(10), ts real)')
+    w=db.writer()
+    start=time.time()
+    for i in range(10000):
+        w.add('insert into events values (%s, %s, %s, %s)', (1, i, 'enter', time.time()))
+    w.flush()
+    print(f"{w.written} rows in {time.time()-start:.3f} sec,",
+          db.exec('select count(*) from events where cam_id=%s', (1,)))
+    db.close()
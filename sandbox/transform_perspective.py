@@ -1,4 +1,6 @@
 import json
+from typing import Dict, Tuple
+
 import numpy as np
 import cv2
 
@@ -10,23 +12,62 @@ class TransformPerspective:
                   '[-0.07921794433374281, 0.2704498997571617, 101.44805742481603], ' \
                   '[6.897423792289868e-06, -0.00066381978017083, 1.0]]'
     calibr_wh = (847, 567)
+    _maps_cache: Dict[tuple, Tuple[np.ndarray, np.ndarray]] = {}  # remap tables shared by same cams/calibrations
 
-    def __init__(self, shape=(720, 1280), resize_to_shape=True):
-        self.trans_mat = np.array(json.loads(TransformPerspective.calibr_json))
-        self.calibr_wh = TransformPerspective.calibr_wh
+    def __init__(self, shape=(720, 1280), resize_to_shape=True, use_remap=True, trans_mat=None, calibr_wh=None):
+        self.trans_mat = np.array(json.loads(TransformPerspective.calibr_json)) if trans_mat is None \
+            else np.asarray(trans_mat, dtype=np.float64)
+        self.calibr_wh = tuple(calibr_wh or TransformPerspective.calibr_wh)
         self.shape = shape[:2]
         self.resize_to_shape = resize_to_shape
+        self.resize_ratio = 1.0
+        self.top = self.bottom = self.left = self.right = 0
         if resize_to_shape:
-            ratio_w = self.shape[1] / TransformPerspective.calibr_wh[0]  # shape: (h,w) but calibr_wh: (w,h)
-            ratio_h = self.shape[0] / TransformPerspective.calibr_wh[1]  # shape: (h,w) but calibr_wh: (w,h)
+            ratio_w = self.shape[1] / self.calibr_wh[0]  # shape: (h,w) but calibr_wh: (w,h)
+            ratio_h = self.shape[0] / self.calibr_wh[1]  # shape: (h,w) but calibr_wh: (w,h)
             self.resize_ratio = min(ratio_w, ratio_h)  # we have to save w-h proportion so the same ratio for w and h
 
-            delta_w = int(shape[1] - TransformPerspective.calibr_wh[0] * self.resize_ratio)
-            delta_h = int(shape[0] - TransformPerspective.calibr_wh[1] * self.resize_ratio)
+            delta_w = int(shape[1] - self.calibr_wh[0] * self.resize_ratio)
+            delta_h = int(shape[0] - self.calibr_wh[1] * self.resize_ratio)
             self.top, self.bottom = delta_h // 2, delta_h - (delta_h // 2)
             self.left, self.right = delta_w // 2, delta_w - (delta_w // 2)
+        self.use_remap = use_remap
+        if use_remap:
+            self.map1, self.map2 = self._remap_tables()
+
+    @classmethod
+    def from_calibration(cls, calibration, shape=(720, 1280), **kwargs):
+        """ transform of cam calibration (calibration.Calibration from CalibrationCache), default one if None """
+        if calibration is None:
+            return cls(shape, **kwargs)
+        return cls(shape, trans_mat=calibration.trans_mat, calibr_wh=(calibration.width, calibration.height), **kwargs)
+
+    def _remap_tables(self) -> Tuple[np.ndarray, np.ndarray]:
+        """ fixed-point cv2.remap tables doing warp + resize + border in one pass (cached) """
+        key = (self.shape, self.resize_to_shape, self.calibr_wh, self.trans_mat.tobytes())
+        maps = TransformPerspective._maps_cache.get(key)
+        if maps is not None:
+            return maps
+        out_h, out_w = self.shape if self.resize_to_shape else self.calibr_wh[::-1]
+        u, v = np.meshgrid(np.arange(out_w, dtype=np.float64), np.arange(out_h, dtype=np.float64))
+        # output pixel --> pixel of warped image before resize (pixel centers as in cv2.resize)
+        x = (u - self.left + 0.5) / self.resize_ratio - 0.5
+        y = (v - self.top + 0.5) / self.resize_ratio - 0.5
+        inside = (x >= -0.5) & (x < self.calibr_wh[0] - 0.5) & (y >= -0.5) & (y < self.calibr_wh[1] - 0.5)
+        # warped image pixel --> source image pixel (inverse homography)
+        inv = np.linalg.inv(self.trans_mat)
+        src = np.einsum('ij,jhw->ihw', inv, np.stack([x, y, np.ones_like(x)]))
+        map_x = np.where(inside, src[0] / src[2], -1).astype(np.float32)  # -1: outside source -> border
+        map_y = np.where(inside, src[1] / src[2], -1).astype(np.float32)
+        maps = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+        TransformPerspective._maps_cache[key] = maps
+        return maps
 
-    def transform_image(self, orig_img):
+    def transform_image(self, orig_img, out=None):
+        """ bird's-eye view of orig_img (written into out if it's given and fits) """
+        if self.use_remap:
+            return cv2.remap(orig_img, self.map1, self.map2, cv2.INTER_LINEAR, dst=out,
+                             borderMode=cv2.BORDER_CONSTANT, borderValue=BGR_BLACK)
         trans_img = cv2.warpPerspective(orig_img, self.trans_mat, self.calibr_wh,
                                         flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_CONSTANT)
         if self.resize_to_shape:
@@ -37,6 +78,20 @@ class TransformPerspective:
                                            cv2.BORDER_CONSTANT, value=BGR_BLACK)
         return trans_img
 
+    def transform_points(self, points) -> np.ndarray:
+        """ (N,2) points of original image --> (N,2) points of transformed image """
+        pts = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+        if not len(pts):
+            return np.empty((0, 2))
+        trans = cv2.perspectiveTransform(pts, self.trans_mat).reshape(-1, 2)
+        return (trans + 0.5) * self.resize_ratio - 0.5 + (self.left, self.top)
+
+    def transform_boxes(self, pers_boxes) -> np.ndarray:
+        """ bottom-center (feet) points of PersBoxLst boxes in transformed image: (N,2) """
+        arr = pers_boxes.arr
+        feet = np.stack([(arr['x_ul'] + arr['x_br']) / 2, arr['y_br']], axis=1)
+        return self.transform_points(feet)
+
 
 if __name__ == "__main__":
     img = cv2.imread("/home/im/mypy/vint/images/input/grid.png")
@@ -0,0 +1,89 @@
+""" snapshot.py - latest frame of each cam, for dashboards/detectors that sample cams at their own rate
+
+Frames are shared by reference (retain/release), not copied: the cache holds the latest frame of each cam
+until the next one arrives. JPEG thumbnails are encoded lazily and cached till the next frame.
+"""
+
+import threading
+import time
+from typing import Dict, Optional
+
+import cv2
+
+from config import cfg
+
+
+class CamSnapshot:
+    """ latest frame of one cam + cached thumbnail """
+
+    def __init__(self):
+        self.frame = None
+        self.seq: int = 0  # number of frames passed through snapshot
+        self.thumb: tuple = (None, None)  # ((seq, width), jpeg bytes) of cached thumbnail
+
+
+class SnapshotCache:
+    """ cam_id -> latest frame (updated by publish_frame, independent of frames processing) """
+    _snapshots: Dict[int, CamSnapshot] = {}
+    _lock = threading.Lock()  # held only to swap/retain frame references
+
+    @classmethod
+    def update(cls, frame):
+        """ make frame the latest one for its cam """
+        frame.retain()
+        with cls._lock:
+            snap = cls._snapshots.get(frame.cam_id)
+            if snap is None:
+                snap = cls._snapshots[frame.cam_id] = CamSnapshot()
+            old, snap.frame = snap.frame, frame
+            snap.seq += 1
+        if old is not None:
+            old.release()
+
+    @classmethod
+    def latest(cls, cam_id: int):
+        """ latest frame of cam (retained: caller has to call frame.release()) or None """
+        with cls._lock:
+            snap = cls._snapshots.get(cam_id)
+            if snap is None or snap.frame is None:
+                return None
+            return snap.frame.retain()
+
+    @classmethod
+    def age(cls, cam_id: int) -> Optional[float]:
+        """ seconds since latest frame of cam was grabbed (None if there is no frame yet) """
+        snap = cls._snapshots.get(cam_id)
+        frame = snap.frame if snap is not None else None
+        return time.time() - frame.time if frame is not None else None
+
+    @classmethod
+    def thumbnail(cls, cam_id: int, width: int = None) -> Optional[bytes]:
+        """ JPEG of latest frame resized to width (encoded once per frame) """
+        width = width or cfg['snapshot_thumb_width']
+        with cls._lock:
+            snap = cls._snapshots.get(cam_id)
+            if snap is None or snap.frame is None:
+                return None
+            key = (snap.seq, width)
+            cached_key, thumb = snap.thumb
+            if cached_key == key:
+                return thumb
+            frame = snap.frame.retain()
+        try:
+            h, w = frame.image.shape[:2]
+            image = cv2.resize(frame.image, (width, h * width // w), interpolation=cv2.INTER_AREA)
+            ok, buf = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, cfg['snapshot_jpeg_quality']])
+            thumb = buf.tobytes() if ok else None
+            snap.thumb = (key, thumb)
+            return thumb
+        finally:
+            frame.release()
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            snapshots = list(cls._snapshots.values())
+            cls._snapshots.clear()
+        for snap in snapshots:
+            if snap.frame is not None:
+                snap.frame.release()
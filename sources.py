@@ -0,0 +1,167 @@
+""" sources.py - offline frame sources with cv2.VideoCapture interface (for tests and benchmarks)
+
+Access strings:
+    synthetic:WxH       generated frames of W x H
+    file:<path>         video file, looped if cam 'loop' option is set
+anything else is opened by cv2.VideoCapture (rtsp url, device, file without looping) with cam capture options.
+Offline sources deliver source_fps frames per sec (0 - as fast as possible).
+"""
+
+import os
+import time
+from typing import Dict
+
+import cv2
+import numpy as np
+
+SYNTHETIC_PREFIX = 'synthetic:'
+FILE_PREFIX = 'file:'
+BACKENDS = {'any': cv2.CAP_ANY, 'ffmpeg': cv2.CAP_FFMPEG, 'gstreamer': cv2.CAP_GSTREAMER}
+_FFMPEG_ENV = 'OPENCV_FFMPEG_CAPTURE_OPTIONS'  # read by opencv ffmpeg backend when capture is opened
+
+
+class _PacedCapture:
+    """ grab() waits till next frame is due (if fps is set) """
+
+    def __init__(self, fps: float):
+        self.fps: float = fps
+        self._next_due: float = 0.0
+
+    def _wait_due(self):
+        if not self.fps:
+            return
+        now = time.monotonic()
+        if self._next_due > now:
+            time.sleep(self._next_due - now)
+        self._next_due = max(self._next_due, now) + 1.0 / self.fps
+
+    def read(self, image: np.ndarray = None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image=image)
+
+    def get(self, prop_id: int) -> float:
+        return self.fps if prop_id == cv2.CAP_PROP_FPS else 0.0
+
+    def set(self, prop_id: int, value: float) -> bool:
+        return False
+
+
+class SyntheticCapture(_PacedCapture):
+    """ generated frames: a few precomputed patterns with moving band, copied into image on retrieve() """
+    _patterns: int = 8
+
+    def __init__(self, width: int, height: int, fps: float = 0.0):
+        super().__init__(fps)
+        x = np.arange(width, dtype=np.uint16)[None, :]
+        y = np.arange(height, dtype=np.uint16)[:, None]
+        self._frames = []
+        for i in range(self._patterns):
+            band = ((x + y + i * width // self._patterns) % 256).astype(np.uint8)
+            self._frames.append(np.dstack([band, np.roll(band, i * 16, axis=1), 255 - band]))
+        self._index: int = -1
+        self._opened: bool = True
+
+    def isOpened(self) -> bool:
+        return self._opened
+
+    def grab(self) -> bool:
+        if not self._opened:
+            return False
+        self._wait_due()
+        self._index += 1
+        return True
+
+    def retrieve(self, image: np.ndarray = None):
+        src = self._frames[self._index % self._patterns]
+        if image is None or image.shape != src.shape or image.dtype != src.dtype:
+            return True, src.copy()
+        np.copyto(image, src)
+        return True, image
+
+    def release(self):
+        self._opened = False
+
+
+class FileCapture(_PacedCapture):
+    """ video file, rewound to start at the end if loop is set """
+
+    def __init__(self, path: str, fps: float = 0.0, loop: bool = True):
+        super().__init__(fps)
+        self.path: str = path
+        self.loop: bool = loop
+        self._cap = cv2.VideoCapture(path)
+
+    def isOpened(self) -> bool:
+        return self._cap.isOpened()
+
+    def grab(self) -> bool:
+        self._wait_due()
+        if self._cap.grab():
+            return True
+        if not self.loop:
+            return False
+        self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        return self._cap.grab()
+
+    def retrieve(self, image: np.ndarray = None):
+        return self._cap.retrieve(image=image)
+
+    def get(self, prop_id: int) -> float:
+        return self._cap.get(prop_id)
+
+    def release(self):
+        self._cap.release()
+
+
+def ffmpeg_options(transport: str = '', low_latency: bool = False) -> Dict:
+    """ ffmpeg demuxer options ('' - default)
+
+    OpenCV sets its own default (rtsp over tcp) only when no options are passed at all,
+    so rtsp_transport is always set together with other options
+    """
+    options = {}
+    if low_latency:
+        options.update(fflags='nobuffer', max_delay='0')
+    if transport or options:
+        options['rtsp_transport'] = transport or 'tcp'
+    return options
+
+
+def set_ffmpeg_options(options: Dict):
+    """ set ffmpeg demuxer options of all captures opened later ({} - opencv defaults)
+
+    opencv reads them from process environment on each open, so they are site-wide and set once at startup,
+    before cams are opened in parallel (per-cam options would need all opens serialized)
+    """
+    if options:
+        os.environ[_FFMPEG_ENV] = '|'.join(f'{k};{v}' for k, v in options.items())
+
+
+def open_video_capture(access_str: str, backend: str = 'any', buffer_frames: int = 0,
+                       open_timeout: float = 0.0, read_timeout: float = 0.0, threads: int = 0) -> cv2.VideoCapture:
+    """ cv2.VideoCapture with backend frames buffer size, timeouts and decoder threads (0 - backend default),
+    ffmpeg demuxer options are site-wide (see set_ffmpeg_options)
+    """
+    params = []
+    if open_timeout:
+        params += [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, int(open_timeout * 1000)]
+    if read_timeout:
+        params += [cv2.CAP_PROP_READ_TIMEOUT_MSEC, int(read_timeout * 1000)]
+    if threads:
+        params += [cv2.CAP_PROP_N_THREADS, threads]
+    cap = cv2.VideoCapture(access_str, BACKENDS[backend], params)
+    if buffer_frames and cap.isOpened():
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, buffer_frames)  # not all backends support it
+    return cap
+
+
+def open_capture(access_str: str, fps: float = 0.0, loop: bool = True, backend: str = 'any', buffer_frames: int = 0,
+                 open_timeout: float = 0.0, read_timeout: float = 0.0, threads: int = 0):
+    """ capture object for access string (see module docstring) """
+    if access_str.startswith(SYNTHETIC_PREFIX):
+        width, height = (int(v) for v in access_str[len(SYNTHETIC_PREFIX):].lower().split('x'))
+        return SyntheticCapture(width, height, fps)
+    if access_str.startswith(FILE_PREFIX):
+        return FileCapture(access_str[len(FILE_PREFIX):], fps, loop)
+    return open_video_capture(access_str, backend, buffer_frames, open_timeout, read_timeout, threads)
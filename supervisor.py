@@ -0,0 +1,199 @@
+""" supervisor.py - capture workers with reconnects and watchdog
+
+Every cam is served by CamWorker thread: open with timeout, read while ok, reconnect with jittered
+exponential backoff. Workers start at once, so startup time is bounded by the slowest cam, not their sum.
+Supervisor watches workers: worker of online cam without progress for supervisor_stall_timeout (stuck in
+backend call) is replaced by new one at once, worker finished unexpectedly (crashed) - after jittered backoff;
+stuck worker exits when its call returns.
+Cam health: connecting | online | backoff | stalled | stopped (Camera.health).
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Callable, Dict, List
+
+from config import cfg
+from camera import Camera
+from metrics import Metrics
+
+CONNECTING, ONLINE, BACKOFF, STALLED, STOPPED = 'connecting', 'online', 'backoff', 'stalled', 'stopped'
+
+
+class Backoff:
+    """ reconnect delays: doubled on each failure up to max_delay, randomly reduced by up to jitter part """
+
+    def __init__(self, min_delay: float, max_delay: float, jitter: float = 0.0):
+        self.min_delay: float = min_delay
+        self.max_delay: float = max_delay
+        self.jitter: float = jitter
+        self._delay: float = min_delay
+
+    def next(self) -> float:
+        delay = self._delay * (1 - self.jitter * random.random())
+        self._delay = min(self._delay * 2, self.max_delay)
+        return delay
+
+    def reset(self):
+        self._delay = self.min_delay
+
+
+class CamWorker(threading.Thread):
+    """ capture thread of one cam: connect, read and publish frames, reconnect on errors """
+
+    def __init__(self, cam: Camera, publish: Callable[[Camera], bool], generation: int = 0):
+        super().__init__(name="_worker_" + cam.cam_name, daemon=True)
+        self.cam: Camera = cam
+        self.generation: int = generation  # worker is stale when supervisor started newer one for the cam
+        self.heartbeat: float = time.monotonic()  # last progress of the worker
+        self._publish: Callable[[Camera], bool] = publish
+        self._stop_event = threading.Event()
+        self.stale: bool = False
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _active(self) -> bool:
+        return not self._stop_event.is_set() and not self.stale
+
+    def _set_health(self, state: str):
+        if not self.stale:
+            self.cam.health = state
+
+    def _read(self) -> bool:
+        self.heartbeat = time.monotonic()
+        try:
+            if not self.cam.get_frame():
+                return False
+            self._publish(self.cam)
+        except Exception:
+            logging.exception(f"Capture error in {self.cam}")
+            return False
+        return True
+
+    def run(self):
+        backoff = Backoff(cfg['ingest_backoff_min'], cfg['ingest_backoff_max'], cfg['ingest_backoff_jitter'])
+        while self._active():
+            self._set_health(CONNECTING)
+            self.heartbeat = time.monotonic()
+            logging.debug(f"{self.cam} is waiting for connect")
+            if self.cam.open(cfg['camera_open_timeout']):
+                logging.info(f"{self.cam} connected")
+                self._set_health(ONLINE)
+                backoff.reset()
+                while self._active() and self._read():
+                    pass
+                if not self._active():
+                    break
+                logging.warning(f"Read error in {self.cam}")
+            else:
+                logging.warning(f"Can't connect {self.cam}")
+            self.cam.close()
+            self.cam.reconnects += 1
+            Metrics.count('reconnects', self.cam.cam_name)
+            self._set_health(BACKOFF)
+            self.heartbeat = time.monotonic()
+            if self._stop_event.wait(backoff.next()):
+                break
+        if not self.stale:  # stale worker leaves cam to its successor
+            self.cam.close()
+            self._set_health(STOPPED)
+
+
+class Supervisor(threading.Thread):
+    """ runs CamWorker for each cam, replaces stuck or dead ones """
+
+    def __init__(self, cams: List[Camera], publish: Callable[[Camera], bool]):
+        super().__init__(name='Supervisor', daemon=True)
+        self.cams: List[Camera] = cams
+        self._publish: Callable[[Camera], bool] = publish
+        self.workers: Dict[int, CamWorker] = {}  # cam_id -> current worker
+        self._restart_backoff: Dict[int, Backoff] = {}  # cam_id -> delays of crashed worker restarts
+        self._restart_due: Dict[int, float] = {}  # cam_id -> monotonic time to restart crashed worker
+        self._lock = threading.Lock()  # workers are changed by check() and by add_cam/remove_cam (cluster thread)
+        self.restarts: int = 0
+        self._stop_event = threading.Event()
+
+    def start(self):
+        with self._lock:
+            for cam in self.cams:
+                self._start_worker(cam, 0)
+        super().start()
+
+    def _start_worker(self, cam: Camera, generation: int):
+        worker = self.workers[cam.cam_id] = CamWorker(cam, self._publish, generation)
+        worker.start()
+        logging.debug(f'CamWorker for {cam} started')
+
+    def run(self):
+        while not self._stop_event.wait(cfg['supervisor_check_interval']):
+            self.check()
+
+    def check(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._stop_event.is_set():  # stop() may be waiting for workers
+                return
+            for cam_id, worker in list(self.workers.items()):
+                if worker.is_alive():
+                    if worker.cam.health == ONLINE and cam_id in self._restart_backoff:
+                        self._restart_backoff.pop(cam_id)  # restarted worker works: next crash is restarted soon
+                    if worker.cam.health != ONLINE or now - worker.heartbeat <= cfg['supervisor_stall_timeout']:
+                        continue
+                    logging.warning(f"{worker.name} is stuck, starting new one")
+                    worker.cam.health = STALLED
+                    worker.stale = True  # exits (without touching cam) when its blocking call returns
+                else:
+                    if cam_id not in self._restart_due:
+                        backoff = self._restart_backoff.setdefault(cam_id, Backoff(
+                            cfg['ingest_backoff_min'], cfg['ingest_backoff_max'], cfg['ingest_backoff_jitter']))
+                        self._restart_due[cam_id] = now + backoff.next()
+                        logging.warning(f"{worker.name} is dead, restarting in {self._restart_due[cam_id] - now:.1f}s")
+                        worker.cam.health = STALLED
+                    if now < self._restart_due[cam_id]:
+                        continue
+                    del self._restart_due[cam_id]
+                self.restarts += 1
+                Metrics.count('worker_restarts', worker.cam.cam_name)
+                self._start_worker(worker.cam, worker.generation + 1)
+
+    def add_cam(self, cam: Camera):
+        """ start capture of cam (cluster rebalance) """
+        with self._lock:
+            if cam.cam_id in self.workers:
+                return
+            self.cams.append(cam)
+            self._start_worker(cam, 0)
+
+    def remove_cam(self, cam: Camera):
+        """ stop capture of cam (cluster rebalance), wait for its worker up to supervisor_stop_timeout """
+        with self._lock:
+            worker = self.workers.pop(cam.cam_id, None)
+            if worker is None:
+                return
+            self.cams.remove(cam)
+            self._restart_backoff.pop(cam.cam_id, None)
+            self._restart_due.pop(cam.cam_id, None)
+        worker.stop()
+        worker.join(cfg['supervisor_stop_timeout'])
+        if worker.is_alive():
+            logging.warning(f"{worker.name} didn't stop")
+            worker.stale = True
+
+    def health(self) -> Dict[str, str]:
+        """ cam_name -> health state """
+        with self._lock:
+            return {cam.cam_name: cam.health for cam in self.cams}
+
+    def stop(self):
+        """ stop watchdog and workers, wait for them up to supervisor_stop_timeout each """
+        self._stop_event.set()
+        with self._lock:
+            workers = list(self.workers.values())
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            worker.join(cfg['supervisor_stop_timeout'])
+            if worker.is_alive():
+                logging.warning(f"{worker.name} didn't stop")
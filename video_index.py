@@ -0,0 +1,98 @@
+""" video_index.py - on-disk time index of recorded video segments
+
+Each cam is recorded into numbered segment files <cam_name>_<segment:06d><suffix>.
+Index file <cam_name>.idx has fixed-size records (time, segment, frame offset) in time order,
+so frames for a time window are found by binary search instead of decoding the video.
+"""
+
+import os
+import struct
+from typing import Iterator, Tuple
+
+import cv2
+import numpy as np
+
+from config import cfg
+
+INDEX_RECORD = struct.Struct('<dII')  # frame time (epoch sec), segment number, frame offset in segment
+INDEX_DTYPE = np.dtype([('time', '<f8'), ('segment', '<u4'), ('frame', '<u4')])
+
+
+def index_file_name(folder: str, cam_name: str) -> str:
+    return f"{folder}{cam_name}.idx"
+
+
+def segment_file_name(folder: str, cam_name: str, segment: int) -> str:
+    return f"{folder}{cam_name}_{segment:06d}{cfg['write_frames_suffix']}"
+
+
+class VideoIndexWriter:
+    """ append records to cam index file; segment numbering continues after last indexed segment """
+
+    def __init__(self, folder: str, cam_name: str):
+        self.folder: str = folder
+        self.cam_name: str = cam_name
+        file_name = index_file_name(folder, cam_name)
+        self.segment: int = -1  # current segment number
+        if os.path.exists(file_name):
+            size = os.path.getsize(file_name)
+            os.truncate(file_name, size - size % INDEX_RECORD.size)  # drop partial record after crash
+            if size >= INDEX_RECORD.size:
+                with open(file_name, 'rb') as f:
+                    f.seek(-INDEX_RECORD.size, os.SEEK_END)
+                    self.segment = INDEX_RECORD.unpack(f.read(INDEX_RECORD.size))[1]
+        self._file = open(file_name, 'ab')
+        self.frame: int = 0  # offset of next frame in current segment
+
+    def next_segment(self) -> str:
+        """ start new segment, return its file name """
+        self.segment += 1
+        self.frame = 0
+        return segment_file_name(self.folder, self.cam_name, self.segment)
+
+    def add(self, frame_time: float):
+        """ index next frame written to current segment """
+        self._file.write(INDEX_RECORD.pack(frame_time, self.segment, self.frame))
+        self.frame += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class VideoIndex:
+    """ read-only access to recorded video of one cam by time """
+
+    def __init__(self, cam_name: str, folder: str = None):
+        self.folder: str = folder or cfg['write_frames_folder']
+        self.cam_name: str = cam_name
+        file_name = index_file_name(self.folder, cam_name)
+        n = os.path.getsize(file_name) // INDEX_RECORD.size if os.path.exists(file_name) else 0
+        self._records: np.ndarray = np.memmap(file_name, INDEX_DTYPE, 'r', shape=(n,)) if n \
+            else np.empty(0, INDEX_DTYPE)
+
+    def __len__(self):
+        return len(self._records)
+
+    def lookup(self, time_from: float, time_to: float) -> np.ndarray:
+        """ index records (time, segment, frame) with time_from <= time < time_to (binary search) """
+        times = self._records['time']
+        lo = np.searchsorted(times, time_from, side='left')
+        hi = np.searchsorted(times, time_to, side='left')
+        return np.array(self._records[lo:hi])
+
+    def read_frames(self, time_from: float, time_to: float) -> Iterator[Tuple[float, np.ndarray]]:
+        """ yield (time, image) of recorded frames in [time_from,time_to) seeking directly to first frame """
+        records = self.lookup(time_from, time_to)
+        for segment in np.unique(records['segment']):
+            seg_records = records[records['segment'] == segment]
+            cap = cv2.VideoCapture(segment_file_name(self.folder, self.cam_name, int(segment)))
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(seg_records['frame'][0]))
+            for rec in seg_records:
+                ok, image = cap.read()
+                if not ok:
+                    break
+                yield float(rec['time']), image
+            cap.release()
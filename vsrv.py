@@ -2,54 +2,82 @@ import threading
 import datetime
 import time
 import logging
-import os
-from queue import Queue
-from typing import Dict
+from typing import Dict, List
 
 import numpy as np
 import cv2
 
 from config import cfg
 from camera import Camera
+from calibration import CalibrationCache
+from frame_bus import FrameBus
+from frame_pool import frame_pool
+from frame_procs import ProcFrameProcessor
+from async_ingest import AsyncIngestor
+from supervisor import Supervisor
+from cluster import ClusterNode, FrameRelay, node_index
+from frame_writer import FrameWriter
+from passthrough import PassthroughRecorder
+from sources import ffmpeg_options, set_ffmpeg_options
+from snapshot import SnapshotCache
+from detector import Detector, PersBoxedFrame
+from motion import MotionGate
+from eventor import Eventor
+from metrics import Metrics, MetricsReporter, MetricsServer
+from dashboard import Dashboard
+from load_shedder import LoadShedder, is_shed, DISPLAY, DOWNSCALE, DETECTION
 
-_frames_queue = Queue(cfg['camera_frames_que_size']) # put: frames from CamWorker threads; get: FrameProcessor
-_stop_flag = False  # set True to stop all threads
+_ingestor: AsyncIngestor = None  # cams capture engine in 'async' ingest mode
+_supervisor: Supervisor = None  # cams capture workers in 'threads' ingest mode
+_cluster: ClusterNode = None  # assigns cams to this node in cluster mode
+_relay: FrameRelay = None  # created on first frame in the process that runs frame handlers
+_relay_counters: Dict[int, int] = {}  # cam_id -> frames since last frame forwarded to aggregator
+_detector: Detector = None  # created on first frame in the process that runs frame handlers
+_detect_counters: Dict[int, int] = {}  # cam_id -> frames since last frame passed to detector
+_monitor_threads: list = []  # MetricsReporter, MetricsServer, Dashboard
+_shedder: LoadShedder = None  # degrades processing under overload (if load_shedding is set)
 
 class Frame:
-    """ camera frame (image, cam info, timestamp) """
-    def __init__(self, cam_id: int, image: np.ndarray, timestamp: str):
+    """ camera frame (image, cam info, capture time)
+
+    image is a frame_pool buffer: it returns to the pool when the last holder calls release()
+    """
+    _refs_lock = threading.Lock()
+
+    def __init__(self, cam_id: int, image: np.ndarray, frame_time: float):
         self.cam_id:int = cam_id
         self.cam_name:str = Camera.cam_list[cam_id].cam_name
-        self.timestamp:str = timestamp
+        self.time:float = frame_time  # epoch seconds when frame was grabbed from cam
+        self.timestamp:str = datetime.datetime.fromtimestamp(frame_time).strftime("%y-%m-%d_%H:%M:%S:%f")
         self.image:np.ndarray = image
+        self.queued_time:float = frame_time  # epoch seconds when frame was put in frame bus
+        self.scale:float = 1.0  # image size / cam frame size (< 1 if downscaled by load shedding)
+        self._refs:int = 1
 
     def __str__(self):
         return f"Frame({self.cam_id},{self.cam_name},{self.timestamp})"
 
+    def retain(self) -> "Frame":
+        """ one more holder of the frame (every retain() needs its own release()) """
+        with Frame._refs_lock:
+            self._refs += 1
+        return self
 
-class CamWorker(threading.Thread):
-    """ one thread per each cam """
-    def __init__(self, cam:Camera):
-        super().__init__(name="_worker_" + cam.cam_name)
-        self.cam : Camera = cam
+    def release(self):
+        with Frame._refs_lock:
+            self._refs -= 1
+            if self._refs:
+                return
+        frame_pool.release(self.image)
+        self.image = None
 
-    def run(self):
-        """ run endless: take image, create frame, put in queue """
-        logging.debug(f"{self.cam} is waiting for connect")
-        self.cam.open()
-        logging.info(f"{self.cam} connected")
-        while not _stop_flag:
-            if not _frames_queue.full():
-                self.cam.get_frame()
-                if not self.cam.read_ok:
-                    logging.warning(f"Read error in {self.cam}")
-                    time.sleep(5)
-                    continue
-                frame = Frame(self.cam.cam_id,
-                              self.cam.image,
-                              datetime.datetime.now().strftime("%y-%m-%d_%H:%M:%S:%f"))
-                _frames_queue.put(frame)
-                logging.debug(f'Put {frame}. Quesize={_frames_queue.qsize()}')
+
+def _on_bus_drop(frame: Frame):
+    Metrics.count('dropped', frame.cam_name)
+    frame.release()
+
+
+_frame_bus = FrameBus(cfg['camera_frames_que_size'], on_drop=_on_bus_drop) # put: capture workers; get: FrameProcessor
 
 
 class FrameProcessor(threading.Thread):
@@ -59,92 +87,240 @@ class FrameProcessor(threading.Thread):
         return
 
     def run(self):
-        while not _stop_flag:
-            if not _frames_queue.empty():
-                frame: Frame = _frames_queue.get()
-                logging.debug(f'Get {frame}. Qsize = {_frames_queue.qsize()}')
-                if cfg['show_frames']:
-                    show_frame(frame)
-                if cfg['write_frames']:
-                    FrameWriter.write_frame(frame)
+        while not _frame_bus.closed:
+            frame: Frame = _frame_bus.get(cfg['frame_bus_timeout'])
+            if frame is None:  # timeout or bus is closed
+                continue
+            logging.debug('Get %s. Qsize = %d', frame, _frame_bus.qsize())
+            start = time.time()
+            Metrics.observe('queue', frame.cam_name, start - frame.queued_time)
+            try:
+                process_frame(frame)
+            except Exception:
+                logging.exception(f"Error while processing {frame}")
+            end = time.time()
+            Metrics.observe('process', frame.cam_name, end - start)
+            Metrics.observe('latency', frame.cam_name, end - frame.time)  # grab --> processed
+            frame.release()  # image buffer goes back to frame_pool
+        close_handlers()  # here, not in stop_vserv: the last frame may be still in process_frame then
+
 
+# vserv own functions:
 
-class FrameWriter:
-    """ Write frames to videofile
+def publish_frame(cam: Camera) -> bool:
+    """ make frame from last image read by cam and put it in frame bus, return True if frame is queued """
+    image, scale = cam.image, 1.0
+    if is_shed(DOWNSCALE):
+        width = image.shape[1]
+        image = downscale(image, cfg['shed_downscale'])
+        scale = image.shape[1] / width
+    frame = Frame(cam.cam_id, image, cam.frame_time)
+    frame.scale = scale
+    SnapshotCache.update(frame)
+    Metrics.count('frames', cam.cam_name)
+    frame.queued_time = time.time()
+    if _frame_bus.put(frame, cam.overflow_policy, cfg['frame_bus_timeout']):
+        logging.debug('Put %s. Quesize=%d', frame, _frame_bus.qsize())
+        return True
+    Metrics.count('dropped', cam.cam_name)
+    frame.release()
+    return False
 
-    videofiles are being created when first frame is arrived (to avoid manual configuring of shape info)
-    """
-    _handles: Dict[int, cv2.VideoWriter] = {}
-
-    @classmethod
-    def _create_video_file(cls, frame:Frame) -> cv2.VideoWriter:
-        if frame.cam_id in cls._handles.keys():  # is already opened
-            return cls._handles[frame.cam_id]
-        folder = cfg['write_frames_folder']
-        os.makedirs(folder, exist_ok=True)
-        file_name = f"{folder}{frame.cam_name}{cfg['write_frames_suffix']}"
-        shape = (frame.image.shape[1], frame.image.shape[0])
-        fh = cv2.VideoWriter(file_name, cfg['write_frames_four_cc'], cfg['write_frames_fps'], shape)
-        cls._handles[frame.cam_id] = fh
-        logging.debug(f"Video file {file_name} created: shape={shape}, fps={cfg['write_frames_fps']}")
-        return fh
-
-    @classmethod
-    def write_frame(cls, frame: Frame):
-        try:
-            fh = cls._handles[frame.cam_id]
-        except KeyError:
-            fh = cls._create_video_file(frame)
-        fh.write(frame.image)
-
-    @classmethod
-    def close_all(cls):
-        """ close all opened video files """
-        for cam_id in cls._handles.keys():
-            cls._handles[cam_id].release()
-            logging.debug(f'File for {Camera.cam_list[cam_id]} is closed')
+def downscale(image: np.ndarray, factor: float) -> np.ndarray:
+    """ image resized by factor into new frame_pool buffer (image buffer goes back to the pool) """
+    h, w = image.shape[:2]
+    small = frame_pool.acquire((max(1, int(h * factor)), max(1, int(w * factor))) + image.shape[2:], image.dtype)
+    cv2.resize(image, (small.shape[1], small.shape[0]), dst=small, interpolation=cv2.INTER_AREA)
+    frame_pool.release(image)
+    return small
 
-# vserv own functions:
+def process_frame(frame: Frame):
+    """ call frame handlers (in FrameProcessor thread or in frame processing worker process) """
+    if cfg['show_frames'] and not is_shed(DISPLAY):
+        show_frame(frame)
+    if cfg['write_frames'] and Camera.cam_list[frame.cam_id].record_mode == 'encode':
+        FrameWriter.write_frame(frame)
+    if cfg['detect_persons']:
+        n = _detect_counters.get(frame.cam_id, 0)
+        _detect_counters[frame.cam_id] = n + 1
+        if n % cfg['detect_every_n_frames'] == 0 and not is_shed(DETECTION) \
+                and (not cfg['motion_gate'] or MotionGate.check(frame)):
+            get_detector().submit(frame)
+        else:
+            Eventor.predict(frame)  # tracks are interpolated between detections
+    if cfg['cluster_relay']:
+        n = _relay_counters.get(frame.cam_id, 0)
+        _relay_counters[frame.cam_id] = n + 1
+        relay = get_relay()
+        if cfg['cluster_relay_every_n'] and n % cfg['cluster_relay_every_n'] == 0:
+            relay.send_frame(frame)
+
+def get_detector() -> Detector:
+    global _detector
+    if _detector is None:
+        _detector = Detector(on_pers_boxed_frame)
+        _detector.start()
+    return _detector
+
+def get_relay() -> FrameRelay:
+    global _relay
+    if _relay is None:
+        node = node_index(cfg['cluster_node'], cfg['cluster_nodes']) if cfg['cluster_node'] else 0
+        _relay = FrameRelay(tuple(cfg['cluster_relay']), node, cfg['cluster_relay_codec'],
+                            cfg['snapshot_jpeg_quality'])
+        _relay.start()
+        Eventor.handlers.append(_relay.send_event)
+    return _relay
+
+def on_pers_boxed_frame(pbf: PersBoxedFrame):
+    """ handle detector result (called in Detector thread) """
+    logging.debug('Detected %s', pbf)
+    Eventor.on_pers_boxed_frame(pbf)
+
+def close_handlers():
+    """ finish frame handlers: detector, relay, write-streams """
+    if _detector is not None:
+        _detector.stop()
+        _detector.join()
+    if _relay is not None:
+        _relay.stop()
+        _relay.join()
+    FrameWriter.close_all() # close opened write-streams
 
 def show_frame(frame: Frame):
     """ show cam frame in opencv window related to this cam """
+    start = time.perf_counter()
     cv2.imshow(frame.cam_name, frame.image)
     ch = cv2.waitKey(1) & 0xFF
+    Metrics.observe('display', frame.cam_name, time.perf_counter() - start)
     if ch in [ord('q'), ord('Q'), 27]:
         logging.warning('Cancelled by user')
         stop_vserv()
 
 def wait_workers_to_stop():
     logging.debug("waiting cam workers to stop:")
-    while True:
-        time.sleep(1)
-        workers_left = len([ t.name for t in threading.enumerate() if t.name.startswith("_worker_")])
-        logging.debug(f"{workers_left} workers left ...")
-        if not workers_left:
-            break
+    for t in threading.enumerate():
+        if t.name.startswith("_worker_"):
+            t.join(cfg['supervisor_stop_timeout'])  # workers blocked on frame bus are woken up by _frame_bus.close()
+            logging.debug(f"{t.name} {'stopped' if not t.is_alive() else 'is stuck'}")
     logging.debug("all workers stopped")
 
 def stop_vserv():
     """ Stop work. Close all threads"""
-    global _stop_flag
-    _stop_flag = True
-    FrameWriter.close_all() # close opened write-streams
-    cv2.destroyAllWindows()
+    if _cluster is not None:
+        _cluster.stop()
+    if _ingestor is not None:
+        _ingestor.stop()
+    if _supervisor is not None:
+        _supervisor.stop()
+    if _shedder is not None:
+        _shedder.stop()
+    _frame_bus.close()  # wake up threads waiting on frame bus
+    logging.info(f"Dropped frames: {_frame_bus.dropped}")
+    logging.info(f"Frame pool: {frame_pool.stats()}")
+    logging.info(f"Metrics:\n{Metrics.summary()}")
+    for t in _monitor_threads:
+        t.stop()
+    PassthroughRecorder.stop_all()
+    SnapshotCache.clear()
+    if cfg['show_frames']:
+        cv2.destroyAllWindows()
     wait_workers_to_stop()
 
 
-def main():
-    logging.basicConfig(level=logging.DEBUG, style='{', format='{threadName:22s}:{message}')
+def start_metrics():
+    """ register gauges of shared components, start periodic summary, http endpoint and dashboard """
+    Metrics.collectors.append(lambda: {'frame_bus_dropped': sum(_frame_bus.dropped.values()),
+                                       'frame_bus_qsize': _frame_bus.qsize()})
+    Metrics.collectors.append(lambda: {f'frame_pool_{k}': v for k, v in frame_pool.stats().items()})
+    Metrics.collectors.append(lambda: {f'calibration_{k}': v for k, v in CalibrationCache.stats().items()})
+    if cfg['metrics_log_interval']:
+        _monitor_threads.append(MetricsReporter(cfg['metrics_log_interval']))
+    if cfg['metrics_port'] is not None:
+        port = cfg['metrics_port']
+        if cfg['cluster_node']:  # nodes may share host
+            port += node_index(cfg['cluster_node'], cfg['cluster_nodes'])
+        _monitor_threads.append(MetricsServer(cfg['metrics_host'], port))
+    if cfg['dashboard']:
+        _monitor_threads.append(Dashboard(Camera.cam_list, _frame_bus, cfg['dashboard_hz']))
+    for t in _monitor_threads:
+        t.start()
 
-    Camera.init_cameras()
 
-    fp = FrameProcessor()
-    fp.start()
-    logging.debug('FrameProcessor started')
+def assign_cams(to_start: List[str], to_stop: List[str]):
+    """ cluster mode: start/stop capture and recording of cams (by name) on this node """
+    cams = {cam.cam_name: cam for cam in Camera.cam_list}
+    capture = _ingestor if _ingestor is not None else _supervisor
+    logging.info(f"Node {cfg['cluster_node']}: start {to_start}, stop {to_stop}")
+    for name in to_stop:
+        if cams[name].decode:
+            capture.remove_cam(cams[name])
+        PassthroughRecorder.stop_cam(cams[name])
+    for name in to_start:
+        if cams[name].decode:
+            capture.add_cam(cams[name])
+        if cfg['write_frames'] and cams[name].record_mode == 'passthrough':
+            PassthroughRecorder.start_all([cams[name]])
 
+
+def start_vserv() -> threading.Thread:
+    """ start processing and capture of cams from Camera.cam_list, return frame processor thread """
+    global _ingestor, _supervisor, _cluster, _shedder
+    if cfg['cluster_node']:
+        node_index(cfg['cluster_node'], cfg['cluster_nodes'])  # fail fast if node is not configured
+    if cfg['detect_persons']:  # fail fast on missing/bad model, not in frame processing
+        if cfg['processing_mode'] == 'process':
+            Detector.load_net()  # each worker process creates own detector on its first frame
+        else:
+            get_detector()
+    set_ffmpeg_options(ffmpeg_options(cfg['camera_transport'], cfg['camera_low_latency']))  # before cams are opened
     for cam in Camera.cam_list:
-        CamWorker(cam).start()
-        logging.debug(f'CamWorker for {cam} started')
+        _frame_bus.add_cam(cam.cam_id, cam.priority)
+
+    # registered before fork: in 'process' mode encoders run in workers, which send their gauges by Metrics.delta()
+    Metrics.collectors.append(lambda: {f'writer_{k}{{cam="{cam}"}}': v for cam, m in FrameWriter.metrics().items()
+                                       for k, v in m.items()})
+    if cfg['processing_mode'] == 'process':  # workers are forked here: before other threads hold any locks
+        fp = ProcFrameProcessor(_frame_bus, process_frame, close_handlers,
+                                cfg['processing_procs'], cfg['processing_shm_slots'], cfg['frame_bus_timeout'],
+                                cfg['processing_metrics_interval'])
+    else:
+        fp = FrameProcessor()
+
+    start_metrics()
+    if cfg['load_shedding']:
+        _shedder = LoadShedder(Camera.cam_list, _frame_bus.fill)
+        Metrics.collectors.append(lambda: {'shed_level': _shedder.level})
+        _shedder.start()
+
+    fp.start()
+    logging.debug(f'{fp.name} started')
+
+    cluster = bool(cfg['cluster_node'])  # cams are started/stopped by cluster assignment
+    if cfg['write_frames'] and not cluster:
+        PassthroughRecorder.start_all([cam for cam in Camera.cam_list if cam.record_mode == 'passthrough'])
+    # cams not decoded are only recorded by passthrough
+    capture_cams = [] if cluster else [cam for cam in Camera.cam_list if cam.decode]
+    if cfg['ingest_mode'] == 'async':
+        _ingestor = AsyncIngestor(capture_cams, publish_frame, cfg['ingest_executor_workers'],
+                                  cfg['ingest_backoff_min'], cfg['ingest_backoff_max'], cfg['ingest_backoff_jitter'])
+        _ingestor.start()
+        logging.debug(f'Async ingestion for {len(capture_cams)} cams started')
+    else:
+        _supervisor = Supervisor(capture_cams, publish_frame)
+        _supervisor.start()
+    if cluster:
+        _cluster = ClusterNode(cfg['cluster_node'], cfg['cluster_nodes'], [cam.cam_name for cam in Camera.cam_list],
+                               assign_cams)
+        _cluster.start()
+    return fp
+
+
+def main():
+    logging.basicConfig(level=cfg['log_level'], style='{', format='{threadName:22s}:{message}')
+
+    Camera.init_cameras()
+    fp = start_vserv()
     try:
         fp.join()  # just wait till FrameProcessor will be stopped
     except KeyboardInterrupt: